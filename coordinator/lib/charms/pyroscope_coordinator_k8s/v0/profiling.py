@@ -60,11 +60,34 @@ class MyCharm(ops.CharmBase):
             "Update all our `profiling` relations, advertising this unit's ingestion endpoint url."
             self._profiling.publish_endpoint(f"{socket.getfqdn()}:1239", insecure=True)
 ```
+
+Besides the otlp_grpc endpoint, providers can advertise the URL of Pyroscope's native push API
+and the endpoints of the individual distributors; requirers find them in the optional fields
+of `Endpoint`, and can pick the protocol that suits them best.
+There is no otlp_http endpoint: the Pyroscope coordinator only proxies OTLP over gRPC.
+
+Providers can also advise requirers on how to send them profiles with `IngestHints` (the
+largest message they accept, how often to send batches, ...), found in `Endpoint.ingest_hints`.
+
+To pick one of several endpoints, `ProfilingEndpointRequirer` offers:
+- `get_preferred_endpoint`, returning the endpoint (and protocol) to use, given the protocols
+  the workload supports, preferring the endpoints in the same Kubernetes cluster;
+- `get_endpoints_by_health`, ordering the endpoints for failover by probing them;
+- `get_otel_collector_config`, returning the OpenTelemetry collector exporters (and processor)
+  that send the profiles to all endpoints, in batches and queued while an endpoint is down.
+
+`publish_endpoint` only writes to the databags that don't hold the endpoint yet, so that
+the requirers aren't woken up by a `relation-changed` when nothing changed; it returns
+the relations it has updated.
 """
 
 import dataclasses
+import json
 import logging
-from typing import List
+import socket
+import time
+from typing import Any, Dict, List, Literal, Optional, Tuple
+from urllib.parse import urlparse
 
 import ops
 import pydantic
@@ -77,13 +100,32 @@ LIBAPI = 0
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 5
+LIBPATCH = 10
 
 DEFAULT_ENDPOINT_NAME = "profiling"
+DEFAULT_LOCAL_DOMAIN = "cluster.local"
+"""The domain of the endpoints in the same Kubernetes cluster as the requirer."""
+DEFAULT_PROBE_TIMEOUT = 1.0
+"""Seconds the connection to an endpoint can take, before it's deemed unhealthy."""
+
+Protocol = Literal["otlp_grpc", "ingest"]
 
 logger = logging.getLogger()
 
 
+class IngestHints(pydantic.BaseModel):
+    """Advice of the provider on how to send it profiles, so that they're accepted and cheap to ingest."""
+
+    max_message_bytes: Optional[int] = None
+    """Largest (compressed) request the provider accepts; larger ones are rejected."""
+    batch_interval: Optional[str] = None
+    """How often to send the profiles collected in the meantime, e.g. "15s"."""
+    max_concurrent_streams: Optional[int] = None
+    """Most requests to send at once over a single connection."""
+    compression: Optional[str] = None
+    """Compression to send the profiles with, e.g. "gzip"."""
+
+
 @dataclasses.dataclass
 class Endpoint:
     """Profiling endpoint."""
@@ -92,6 +134,34 @@ class Endpoint:
     """Ingestion endpoint for otlp_grpc profiling data."""
     insecure: bool = False
     """Whether the ingestion endpoint accepts/demands TLS-encrypted communications."""
+    ingest: Optional[str] = None
+    """URL of Pyroscope's native push API (`/ingest`), if the provider accepts it."""
+    distributors: Optional[List[str]] = None
+    """Ingestion endpoints for otlp_grpc profiling data of the individual distributors,
+    for the clients that balance the load themselves."""
+    ingest_hints: Optional[IngestHints] = None
+    """Advice of the provider on how to batch the profiles, if it gave any."""
+
+    def address(self, protocol: Protocol = "otlp_grpc") -> Optional[str]:
+        """The address to send the profiles to with the given protocol, if it's supported."""
+        return {
+            "otlp_grpc": self.otlp_grpc,
+            "ingest": self.ingest,
+        }[protocol]
+
+    def host_port(self, protocol: Protocol = "otlp_grpc") -> Optional[Tuple[str, int]]:
+        """The host and port to connect to with the given protocol, if it's supported."""
+        address = self.address(protocol)
+        if not address:
+            return None
+        if protocol == "otlp_grpc":
+            # host:port, without scheme
+            address = f"//{address}"
+        url = urlparse(address)
+        if not url.hostname:
+            return None
+        default_port = 443 if url.scheme == "https" or not self.insecure else 80
+        return url.hostname, url.port or default_port
 
 
 class ProfilingAppDatabagModel(pydantic.BaseModel):
@@ -99,6 +169,10 @@ class ProfilingAppDatabagModel(pydantic.BaseModel):
 
     otlp_grpc_endpoint_url: str
     insecure: bool = False
+    # optional, so that the databags of older providers still validate
+    ingest_endpoint_url: Optional[str] = None
+    distributor_endpoint_urls: Optional[List[str]] = None
+    ingest_hints: Optional[IngestHints] = None
 
 
 class ProfilingEndpointProvider:
@@ -112,22 +186,72 @@ class ProfilingEndpointProvider:
         self,
         otlp_grpc_endpoint: str,
         insecure: bool = False,
-    ):
-        """Publish profiling ingestion endpoints to all relations."""
+        ingest_endpoint: Optional[str] = None,
+        distributor_endpoints: Optional[List[str]] = None,
+        ingest_hints: Optional[IngestHints] = None,
+    ) -> List[ops.Relation]:
+        """Publish profiling ingestion endpoints to all relations.
+
+        Args:
+            otlp_grpc_endpoint: the otlp_grpc ingestion endpoint.
+            insecure: whether the endpoints are served without TLS.
+            ingest_endpoint: the URL of Pyroscope's native push API, if any.
+            distributor_endpoints: the otlp_grpc ingestion endpoints of the individual
+                distributors, if the requirers can reach them.
+            ingest_hints: advice on how to batch the profiles sent to the endpoints.
+
+        Returns:
+            The relations whose databag has been updated.
+        """
+        # encoded like `Relation.save` does; the optional fields that aren't
+        # published are removed from the databag (by setting them to "")
+        published = ProfilingAppDatabagModel(
+            otlp_grpc_endpoint_url=otlp_grpc_endpoint,
+            insecure=insecure,
+            ingest_endpoint_url=ingest_endpoint,
+            distributor_endpoint_urls=distributor_endpoints,
+            ingest_hints=ingest_hints,
+        ).model_dump(mode="json", exclude_none=True)
+        data = {
+            key: json.dumps(published[key]) if key in published else ""
+            for key in ProfilingAppDatabagModel.model_fields
+        }
+        changed = []
         for relation in self._relations:
             try:
-                relation.save(
-                    ProfilingAppDatabagModel(
-                        otlp_grpc_endpoint_url=otlp_grpc_endpoint,
-                        insecure=insecure,
-                    ),
-                    self._app,
-                )
+                databag = relation.data[self._app]
+                delta = {
+                    key: value
+                    for key, value in data.items()
+                    if databag.get(key, "") != value
+                }
+                if not delta:
+                    continue
+                databag.update(delta)
             except ops.ModelError:
                 logger.debug(
                     "failed to validate app data; is the relation still being created?"
                 )
                 continue
+            changed.append(relation)
+        return changed
+
+
+def probe(
+    endpoint: Endpoint,
+    protocol: Protocol = "otlp_grpc",
+    timeout: float = DEFAULT_PROBE_TIMEOUT,
+) -> Optional[float]:
+    """Return how many seconds it takes to open a TCP connection to the endpoint, or None if it can't be reached."""
+    host_port = endpoint.host_port(protocol)
+    if not host_port:
+        return None
+    start = time.monotonic()
+    try:
+        with socket.create_connection(host_port, timeout=timeout):
+            return time.monotonic() - start
+    except OSError:
+        return None
 
 
 class ProfilingEndpointRequirer:
@@ -156,6 +280,101 @@ class ProfilingEndpointRequirer:
                 Endpoint(
                     otlp_grpc=data.otlp_grpc_endpoint_url,
                     insecure=data.insecure,
+                    ingest=data.ingest_endpoint_url,
+                    distributors=data.distributor_endpoint_urls,
+                    ingest_hints=data.ingest_hints,
                 )
             )
         return out
+
+    def get_preferred_endpoint(
+        self,
+        protocols: Tuple[Protocol, ...] = ("otlp_grpc",),
+        local_domain: Optional[str] = DEFAULT_LOCAL_DOMAIN,
+    ) -> Optional[Tuple[Endpoint, Protocol]]:
+        """Obtain the endpoint to send profiles to, and the protocol to send them with.
+
+        Args:
+            protocols: the protocols the charm's workload can send profiles with, by preference.
+            local_domain: the domain of the endpoints that are close to the requirer (e.g. in
+                the same Kubernetes cluster), which are preferred over the others.
+
+        Returns:
+            The first endpoint supporting the most preferred protocol, the local ones first;
+            None if no endpoint supports any of the protocols.
+        """
+        endpoints = self.get_endpoints()
+        for protocol in protocols:
+            candidates = [ep for ep in endpoints if ep.address(protocol)]
+            if local_domain:
+                candidates.sort(
+                    key=lambda ep: not _is_local(ep, protocol, local_domain)
+                )
+            if candidates:
+                return candidates[0], protocol
+        return None
+
+    def get_endpoints_by_health(
+        self,
+        protocol: Protocol = "otlp_grpc",
+        timeout: float = DEFAULT_PROBE_TIMEOUT,
+    ) -> List[Endpoint]:
+        """Obtain the endpoints supporting a protocol, ordered for failover.
+
+        Each endpoint is probed with a TCP connection: the reachable ones come first, the
+        fastest to connect to first; the unreachable ones come last, in their relation order.
+        """
+        latencies = []
+        for endpoint in self.get_endpoints():
+            if not endpoint.address(protocol):
+                continue
+            latency = probe(endpoint, protocol, timeout)
+            latencies.append((latency is None, latency or 0, endpoint))
+        # sorted() is stable: ties keep the relation order
+        return [endpoint for *_, endpoint in sorted(latencies, key=lambda x: x[:2])]
+
+    def get_otel_collector_config(
+        self,
+        ca_file: Optional[str] = None,
+        send_batch_size: int = 1000,
+        batch_timeout: str = "10s",
+        queue_size: int = 1000,
+    ) -> Dict[str, Any]:
+        """Obtain the exporters and processor an OpenTelemetry collector can send the profiles to the endpoints with.
+
+        The profiles are batched, and queued while an endpoint is unreachable (and retried),
+        instead of being exported one by one. Add the `batch/profiling` processor and the
+        exporters to the collector's `profiles` pipeline (which, at the time of writing,
+        requires the collector's `service.profilesSupport` feature gate).
+
+        Args:
+            ca_file: path to the CA certificate to verify the TLS endpoints with.
+            send_batch_size: how many profiles are sent at once.
+            batch_timeout: how long a batch waits to fill up before it's sent anyway.
+            queue_size: how many batches are queued per endpoint while it's unreachable.
+        """
+        exporters = {}
+        for i, endpoint in enumerate(self.get_endpoints()):
+            tls: Dict[str, Any] = {"insecure": endpoint.insecure}
+            if ca_file and not endpoint.insecure:
+                tls["ca_file"] = ca_file
+            exporters[f"otlp/profiling-{i}"] = {
+                "endpoint": endpoint.otlp_grpc,
+                "tls": tls,
+                "sending_queue": {"enabled": True, "queue_size": queue_size},
+                "retry_on_failure": {"enabled": True},
+            }
+        return {
+            "processors": {
+                "batch/profiling": {
+                    "send_batch_size": send_batch_size,
+                    "timeout": batch_timeout,
+                }
+            },
+            "exporters": exporters,
+        }
+
+
+def _is_local(endpoint: Endpoint, protocol: Protocol, local_domain: str) -> bool:
+    host_port = endpoint.host_port(protocol)
+    return bool(host_port) and host_port[0].rstrip(".").endswith(local_domain)  # type: ignore
@@ -4,17 +4,24 @@
 
 """Charmed Operator for Pyroscope; a lightweight object storage based profiling backend."""
 
+import json
 import logging
 import socket
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from charms.catalogue_k8s.v1.catalogue import CatalogueItem
 from charms.grafana_k8s.v1.grafana_source import GrafanaSourceProvider
-from charms.pyroscope_coordinator_k8s.v0.profiling import ProfilingEndpointProvider
+from charms.pyroscope_coordinator_k8s.v0.profiling import (
+    Endpoint,
+    IngestHints,
+    ProfilingEndpointProvider,
+    ProfilingEndpointRequirer,
+)
 from charms.traefik_k8s.v0.traefik_route import TraefikRouteRequirer
 from coordinated_workers.coordinator import Coordinator
-from charmlibs.nginx_k8s import NginxConfig, TLSConfigManager
-from ops import BlockedStatus, CollectStatusEvent
+from charmlibs.nginx_k8s import TLSConfigManager
+from lightkube.utils.quantity import parse_quantity
+from ops import ActionEvent, BlockedStatus, CollectStatusEvent
 from ops.charm import CharmBase
 
 import nginx_config
@@ -24,9 +31,12 @@ from charm_config import (
     CharmConfigInvalidError,
     PyroscopeCoordinatorConfigModel,
 )
+from charm_profiling import profile_charm
 from peers import Peers, PEERS_RELATION_ENDPOINT_NAME
-from pyroscope import Pyroscope
-from pyroscope_config import PYROSCOPE_ROLES_CONFIG
+from pyroscope import MAX_PROFILE_SIZE_BYTES, Pyroscope
+from pyroscope_config import PYROSCOPE_ROLES_CONFIG, PyroscopeRole
+import retention
+import scaling
 from cosl.reconciler import all_events, observe_events
 
 logger = logging.getLogger(__name__)
@@ -37,6 +47,14 @@ DISABLED_DATA_CLEANUP_CHARM_CONFIG = CharmConfig(
     )
 )
 PYROSCOPE_GRAFANA_DATASOURCE_TYPE = "grafana-pyroscope-datasource"
+# resources requests of nginx, as (cpu millicores, memory MiB): a base, plus some cpu for each
+# worker unit, as nginx proxies (and, with TLS, terminates) all the traffic to and within the cluster.
+NGINX_RESOURCES_REQUESTS = (50, 100)
+NGINX_CPU_REQUESTS_PER_WORKER_UNIT = 10
+# advised to the profiling clients: the upload interval of the Pyroscope SDKs and Alloy, and a
+# compression the distributors decode natively
+INGEST_BATCH_INTERVAL = "15s"
+INGEST_COMPRESSION = "gzip"
 
 
 class PyroscopeCoordinator(Coordinator):
@@ -53,6 +71,10 @@ class PyroscopeCoordinator(Coordinator):
         return "[degraded] " + self._active_status_msg
 
 
+@profile_charm(
+    profiling_endpoints="charm_profiling_endpoints",
+    server_cert="_ca_cert",
+)
 class PyroscopeCoordinatorCharm(CharmBase):
     """Charmed Operator for Pyroscope; a distributed profiling backend."""
 
@@ -91,6 +113,10 @@ class PyroscopeCoordinatorCharm(CharmBase):
         self.profiling_provider = ProfilingEndpointProvider(
             self.model.relations["profiling"], self.app
         )
+        self.charm_profiling = ProfilingEndpointRequirer(
+            self.model.relations["charm-profiling"]
+        )
+        worker_processes, worker_connections = self._nginx_worker_tuning()
         self.coordinator = PyroscopeCoordinator(
             charm=self,
             roles_config=PYROSCOPE_ROLES_CONFIG,
@@ -109,11 +135,16 @@ class PyroscopeCoordinatorCharm(CharmBase):
                 "receive-datasource": None,
                 "catalogue": "catalogue",
             },
-            nginx_config=NginxConfig(
+            nginx_config=nginx_config.PyroscopeNginxConfig(
                 server_name=self.hostname,
                 upstream_configs=nginx_config.upstreams(Pyroscope.http_server_port),
-                server_ports_to_locations=nginx_config.server_ports_to_locations(),
+                server_ports_to_locations=nginx_config.server_ports_to_locations(
+                    client_max_body_size=self._charm_config.nginx_client_max_body_size,
+                    proxy_buffer_size=self._charm_config.nginx_proxy_buffer_size,
+                ),
                 enable_status_page=True,
+                worker_processes=worker_processes,
+                worker_connections=worker_connections,
             ),
             workers_config=self.pyroscope.config,
             worker_ports=lambda role: (
@@ -123,7 +154,7 @@ class PyroscopeCoordinatorCharm(CharmBase):
             ),
             workload_tracing_protocols=["jaeger_thrift_http"],
             container_name="nginx",
-            resources_requests=lambda _: {"cpu": "50m", "memory": "100Mi"},
+            resources_requests=self._nginx_resources_requests,
             catalogue_item=self._catalogue_item,
             active_status_msg=self._active_status_msg,
         )
@@ -133,6 +164,12 @@ class PyroscopeCoordinatorCharm(CharmBase):
         self.framework.observe(
             self.on.collect_unit_status, self._on_collect_unit_status
         )
+        self.framework.observe(
+            self.on.recommend_scale_action, self._on_recommend_scale_action
+        )
+        self.framework.observe(
+            self.on.list_retention_action, self._on_list_retention_action
+        )
 
     ######################
     # UTILITY PROPERTIES #
@@ -227,11 +264,94 @@ class PyroscopeCoordinatorCharm(CharmBase):
         # If we do not have an ingress, then use the K8s service.
         return self._external_grpc_url or self._internal_grpc_url
 
+    @property
+    def _ingest_hints(self) -> IngestHints:
+        """How the profiling clients should send their profiles, given the limits of nginx and Pyroscope."""
+        max_body_size = nginx_config.size_bytes(
+            self._charm_config.nginx_client_max_body_size
+        )
+        return IngestHints(
+            # nginx rejects larger requests, grpc included ("0" lifts its limit), and
+            # the distributors larger profiles
+            max_message_bytes=min(
+                max_body_size or MAX_PROFILE_SIZE_BYTES, MAX_PROFILE_SIZE_BYTES
+            ),
+            batch_interval=INGEST_BATCH_INTERVAL,
+            max_concurrent_streams=nginx_config.http2_max_concurrent_streams,
+            compression=INGEST_COMPRESSION,
+        )
+
+    @property
+    def _distributor_endpoints(self) -> Optional[List[str]]:
+        """The otlp_grpc endpoints of the individual distributors, when they can be reached directly.
+
+        The workers don't serve TLS, and are only reachable from within the cluster:
+        their endpoints are only worth advertising when nginx isn't terminating TLS or ingressed.
+        """
+        if self._is_ingressed:
+            return None
+        distributors = self.coordinator.cluster.gather_addresses_by_role().get(
+            PyroscopeRole.distributor
+        )
+        if not distributors:
+            return None
+        return [
+            f"{address}:{Pyroscope.http_server_port}"
+            for address in sorted(distributors)
+        ]
+
     @property
     def _http_server_port(self) -> int:
         """The http port that we should open on this pod."""
         return nginx_config.http_server_port
 
+    def _nginx_worker_tuning(self) -> Tuple[int, int]:
+        """The number of nginx worker processes and of connections per worker process."""
+        try:
+            cpu_limit = parse_quantity(self.config.get("cpu_limit"))
+            memory_limit = parse_quantity(self.config.get("memory_limit"))
+        except ValueError:
+            logger.warning("invalid resource limits; not tuning nginx on them")
+            cpu_limit = memory_limit = None
+        worker_processes, worker_connections = nginx_config.worker_tuning(
+            float(cpu_limit) if cpu_limit else None,
+            float(memory_limit) if memory_limit else None,
+            worker_processes=self._charm_config.nginx_worker_processes,
+        )
+        return (
+            worker_processes,
+            self._charm_config.nginx_worker_connections or worker_connections,
+        )
+
+    def _nginx_resources_requests(self, coordinator: Coordinator) -> Dict[str, str]:
+        """The resources requests of the nginx container, given the size of the cluster."""
+        cpu, memory = NGINX_RESOURCES_REQUESTS
+        cpu += NGINX_CPU_REQUESTS_PER_WORKER_UNIT * len(
+            coordinator.cluster.gather_topology()
+        )
+        # kubernetes refuses requests greater than the limits
+        try:
+            if cpu_limit := parse_quantity(self.config.get("cpu_limit")):
+                cpu = min(cpu, int(cpu_limit * 1000))
+            if memory_limit := parse_quantity(self.config.get("memory_limit")):
+                memory = min(memory, int(memory_limit / 2**20))
+        except ValueError:
+            logger.warning(
+                "invalid resource limits; not capping the resources requests"
+            )
+        return {"cpu": f"{cpu}m", "memory": f"{memory}Mi"}
+
+    @property
+    def charm_profiling_endpoints(self) -> List[Endpoint]:
+        """The profiling backend endpoints this charm sends the profiles of its hooks to."""
+        return self.charm_profiling.get_endpoints()
+
+    @property
+    def _ca_cert(self) -> Optional[str]:
+        """The CA certificate of this unit, if TLS is configured."""
+        tls_config = self.coordinator.tls_config
+        return tls_config.ca_cert if tls_config else None
+
     @property
     def _catalogue_item(self) -> CatalogueItem:
         """A catalogue application entry for this Pyroscope instance."""
@@ -254,6 +374,68 @@ class PyroscopeCoordinatorCharm(CharmBase):
             event.add_status(BlockedStatus(exc.msg))
             return
 
+    def _on_recommend_scale_action(self, event: ActionEvent):
+        addresses_by_role = self.coordinator.cluster.gather_addresses_by_role()
+        if not addresses_by_role:
+            event.fail("No workers are related to this coordinator.")
+            return
+
+        current_units = self.coordinator.cluster.gather_roles()
+        event.log("Sampling worker metrics...")
+        sample = scaling.sample_cluster(
+            addresses=set().union(*addresses_by_role.values()),
+            port=Pyroscope.http_server_port,
+            interval=event.params["sample-interval"],
+        )
+        if sample.unreachable:
+            event.log(
+                f"Could not scrape the metrics of: {', '.join(sorted(sample.unreachable))}"
+            )
+        recommended = scaling.recommend(sample, addresses_by_role, current_units)
+        event.set_results(
+            {
+                "current": {role: current_units.get(role, 0) for role in recommended},
+                "recommended": recommended,
+            }
+        )
+
+    def _on_list_retention_action(self, event: ActionEvent):
+        distributors = self.coordinator.cluster.gather_addresses_by_role().get(
+            PyroscopeRole.distributor, set()
+        )
+        ingest_rates = {}
+        if distributors:
+            event.log("Sampling distributor metrics...")
+            sample = scaling.sample_cluster(
+                addresses=distributors,
+                port=Pyroscope.http_server_port,
+                interval=event.params["sample-interval"],
+            )
+            if sample.unreachable:
+                event.log(
+                    f"Could not scrape the metrics of: {', '.join(sorted(sample.unreachable))}"
+                )
+            ingest_rates = sample.rate_by(
+                distributors,
+                "pyroscope_distributor_received_decompressed_bytes_sum",
+                "tenant",
+            )
+        tenants = retention.list_retention(
+            self._charm_config.retention_period,
+            self._charm_config.retention_overrides,
+            ingest_rates,
+        )
+        event.set_results(
+            {
+                "retention-period": self._charm_config.retention_period,
+                # tenant ids aren't valid result keys: list them in a json document instead
+                "tenants": json.dumps([tenant.to_dict() for tenant in tenants]),
+                "estimated-bytes": sum(
+                    tenant.estimated_bytes or 0 for tenant in tenants
+                ),
+            }
+        )
+
     # TODO: use the coordinated_workers method
     # cfr https://github.com/canonical/cos-coordinated-workers/issues/54
     @property
@@ -275,15 +457,19 @@ class PyroscopeCoordinatorCharm(CharmBase):
         self.unit.set_ports(self._http_server_port, nginx_config.grpc_server_port)
         self._peers.reconcile()
         self._reconcile_ingress()
+        # if ingress is configured, rely on its TLS config
+        # otherwise check if internal TLS (certificates on disk) is configured.
+        insecure = not (
+            self._is_external_url_tls
+            if self._is_ingressed
+            else self._are_certificates_on_disk
+        )
         self.profiling_provider.publish_endpoint(
             otlp_grpc_endpoint=self._most_external_grpc_url,
-            # if ingress is configured, rely on its TLS config
-            # otherwise check if internal TLS (certificates on disk) is configured.
-            insecure=not (
-                self._is_external_url_tls
-                if self._is_ingressed
-                else self._are_certificates_on_disk
-            ),
+            insecure=insecure,
+            ingest_endpoint=f"{self._most_external_http_url}/ingest",
+            distributor_endpoints=self._distributor_endpoints if insecure else None,
+            ingest_hints=self._ingest_hints,
         )
         self.grafana_source.update_app_source(self._most_external_http_url)
 
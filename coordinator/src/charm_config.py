@@ -6,18 +6,43 @@
 
 import dataclasses
 import logging
+import re
+from typing import Dict, Literal, Optional
 
 import ops
 from pydantic import (  # pylint: disable=no-name-in-module,import-error
     BaseModel,
     Field,
+    StrictBool,
     StrictStr,
     ValidationError,
+    model_validator,
 )
 
 logger = logging.getLogger(__name__)
 
 TIMESPEC_REGEXP = r"^(0|[0-9]+(y|w|d|h|m|s|ms))$"
+DURATION_REGEXP = r"^([0-9]+(\.[0-9]+)?(ns|us|ms|s|m|h))+$"
+SamplerType = Literal["const", "probabilistic", "ratelimiting", "remote"]
+SSEType = Literal["SSE-S3", "SSE-KMS"]
+NGINX_SIZE_REGEXP = r"^[0-9]+[kKmMgG]?$"
+
+
+def parse_retention_overrides(value: Optional[str]) -> Dict[str, str]:
+    """Parse a list of `tenant=retention period` pairs, separated by commas.
+
+    Raises:
+        ValueError: if a pair is malformed, or a retention period is invalid.
+    """
+    overrides = {}
+    for pair in (value or "").split(","):
+        if not pair.strip():
+            continue
+        tenant, sep, period = (part.strip() for part in pair.partition("="))
+        if not (tenant and sep and re.match(TIMESPEC_REGEXP, period)):
+            raise ValueError(pair)
+        overrides[tenant] = period
+    return overrides
 
 
 class CharmConfigInvalidError(Exception):
@@ -38,6 +63,49 @@ class PyroscopeCoordinatorConfigModel(BaseModel):  # pylint: disable=too-few-pub
     retention_period: StrictStr = Field(default="1d", pattern=TIMESPEC_REGEXP)
     deletion_delay: StrictStr = Field(default="12h", pattern=TIMESPEC_REGEXP)
     cleanup_interval: StrictStr = Field(default="15m", pattern=TIMESPEC_REGEXP)
+    self_profiling: Optional[StrictBool] = None
+    workload_tracing_sampler_type: SamplerType = "const"
+    workload_tracing_sampler_param: float = Field(default=1.0, ge=0)
+    workload_tracing_sampling_server_url: Optional[StrictStr] = None
+    s3_max_idle_connections_per_host: Optional[int] = Field(default=None, ge=0)
+    s3_max_connections_per_host: Optional[int] = Field(default=None, ge=0)
+    s3_idle_connection_timeout: Optional[StrictStr] = Field(
+        default=None, pattern=DURATION_REGEXP
+    )
+    s3_response_header_timeout: Optional[StrictStr] = Field(
+        default=None, pattern=DURATION_REGEXP
+    )
+    s3_sse_type: Optional[SSEType] = None
+    s3_sse_kms_key_id: Optional[StrictStr] = None
+    storage_prefix: Optional[StrictStr] = Field(default=None, pattern=r"^[0-9a-zA-Z]*$")
+    retention_overrides: Optional[StrictStr] = None
+    compactor_downsampling: StrictBool = False
+    querier_max_concurrency: int = Field(default=4, ge=1)
+    nginx_worker_processes: Optional[int] = Field(default=None, ge=1)
+    nginx_worker_connections: Optional[int] = Field(default=None, ge=1)
+    nginx_client_max_body_size: StrictStr = Field(
+        default="32m", pattern=NGINX_SIZE_REGEXP
+    )
+    nginx_proxy_buffer_size: StrictStr = Field(default="16k", pattern=NGINX_SIZE_REGEXP)
+
+    @model_validator(mode="after")
+    def _validate_sampler(self) -> "PyroscopeCoordinatorConfigModel":
+        # the names of the invalid options are reported as the error message
+        sampler_type = self.workload_tracing_sampler_type
+        param = self.workload_tracing_sampler_param
+        if (sampler_type == "const" and param not in (0, 1)) or (
+            sampler_type in ("probabilistic", "remote") and param > 1
+        ):
+            raise ValueError("workload_tracing_sampler_param")
+        if sampler_type == "remote" and not self.workload_tracing_sampling_server_url:
+            raise ValueError("workload_tracing_sampling_server_url")
+        if self.s3_sse_type == "SSE-KMS" and not self.s3_sse_kms_key_id:
+            raise ValueError("s3_sse_kms_key_id")
+        try:
+            parse_retention_overrides(self.retention_overrides)
+        except ValueError:
+            raise ValueError("retention_overrides") from None
+        return self
 
 
 @dataclasses.dataclass
@@ -50,11 +118,51 @@ class CharmConfig:
         deletion_delay: Time before a block marked for deletion is deleted from bucket.
         cleanup_interval: How frequently compactor should run blocks cleanup and maintenance,
             as well as update the bucket index.
+        self_profiling: Whether the Pyroscope workers should push their own profiles to the cluster;
+            if None, Pyroscope's default applies.
+        workload_tracing_sampler_type: The Jaeger sampler the Pyroscope workers trace their requests with.
+        workload_tracing_sampler_param: The parameter of the sampler; its meaning depends on the sampler type.
+        workload_tracing_sampling_server_url: The URL of the sampling server the remote sampler
+            fetches its strategies from.
+        s3_max_idle_connections_per_host: Idle connections the s3 client keeps open to the s3 endpoint.
+        s3_max_connections_per_host: Connections the s3 client can open to the s3 endpoint.
+        s3_idle_connection_timeout: How long the s3 client keeps an idle connection open.
+        s3_response_header_timeout: How long the s3 client waits for the headers of a response.
+        s3_sse_type: The server-side encryption the objects are stored with.
+        s3_sse_kms_key_id: The KMS key the objects are encrypted with, with SSE-KMS.
+        storage_prefix: The prefix of the objects Pyroscope stores in the bucket.
+        retention_overrides: The retention period of the tenants that don't keep their profiles
+            for `retention_period`, by tenant.
+        compactor_downsampling: Whether the compactor downsamples the compacted blocks, for
+            faster queries over long time ranges.
+        querier_max_concurrency: The number of queries each querier runs at once.
+        nginx_worker_processes: Overrides the number of nginx worker processes.
+        nginx_worker_connections: Overrides the connections each nginx worker process can open.
+        nginx_client_max_body_size: The largest request body nginx accepts.
+        nginx_proxy_buffer_size: The size of the buffers nginx reads the upstream responses in.
     """
 
     retention_period: StrictStr
     deletion_delay: StrictStr
     cleanup_interval: StrictStr
+    self_profiling: Optional[StrictBool]
+    workload_tracing_sampler_type: SamplerType
+    workload_tracing_sampler_param: float
+    workload_tracing_sampling_server_url: Optional[StrictStr]
+    s3_max_idle_connections_per_host: Optional[int]
+    s3_max_connections_per_host: Optional[int]
+    s3_idle_connection_timeout: Optional[StrictStr]
+    s3_response_header_timeout: Optional[StrictStr]
+    s3_sse_type: Optional[SSEType]
+    s3_sse_kms_key_id: Optional[StrictStr]
+    storage_prefix: Optional[StrictStr]
+    retention_overrides: Dict[str, str]
+    compactor_downsampling: StrictBool
+    querier_max_concurrency: int
+    nginx_worker_processes: Optional[int]
+    nginx_worker_connections: Optional[int]
+    nginx_client_max_body_size: StrictStr
+    nginx_proxy_buffer_size: StrictStr
 
     def __init__(
         self, *, pyroscope_charm_config_model: PyroscopeCoordinatorConfigModel
@@ -67,6 +175,52 @@ class CharmConfig:
         self.retention_period = pyroscope_charm_config_model.retention_period
         self.deletion_delay = pyroscope_charm_config_model.deletion_delay
         self.cleanup_interval = pyroscope_charm_config_model.cleanup_interval
+        self.self_profiling = pyroscope_charm_config_model.self_profiling
+        self.workload_tracing_sampler_type = (
+            pyroscope_charm_config_model.workload_tracing_sampler_type
+        )
+        self.workload_tracing_sampler_param = (
+            pyroscope_charm_config_model.workload_tracing_sampler_param
+        )
+        self.workload_tracing_sampling_server_url = (
+            pyroscope_charm_config_model.workload_tracing_sampling_server_url
+        )
+        self.s3_max_idle_connections_per_host = (
+            pyroscope_charm_config_model.s3_max_idle_connections_per_host
+        )
+        self.s3_max_connections_per_host = (
+            pyroscope_charm_config_model.s3_max_connections_per_host
+        )
+        self.s3_idle_connection_timeout = (
+            pyroscope_charm_config_model.s3_idle_connection_timeout
+        )
+        self.s3_response_header_timeout = (
+            pyroscope_charm_config_model.s3_response_header_timeout
+        )
+        self.s3_sse_type = pyroscope_charm_config_model.s3_sse_type
+        self.s3_sse_kms_key_id = pyroscope_charm_config_model.s3_sse_kms_key_id
+        self.storage_prefix = pyroscope_charm_config_model.storage_prefix
+        self.retention_overrides = parse_retention_overrides(
+            pyroscope_charm_config_model.retention_overrides
+        )
+        self.compactor_downsampling = (
+            pyroscope_charm_config_model.compactor_downsampling
+        )
+        self.querier_max_concurrency = (
+            pyroscope_charm_config_model.querier_max_concurrency
+        )
+        self.nginx_worker_processes = (
+            pyroscope_charm_config_model.nginx_worker_processes
+        )
+        self.nginx_worker_connections = (
+            pyroscope_charm_config_model.nginx_worker_connections
+        )
+        self.nginx_client_max_body_size = (
+            pyroscope_charm_config_model.nginx_client_max_body_size
+        )
+        self.nginx_proxy_buffer_size = (
+            pyroscope_charm_config_model.nginx_proxy_buffer_size
+        )
 
     @classmethod
     def from_charm(
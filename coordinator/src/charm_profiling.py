@@ -0,0 +1,239 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Profile the charm code itself, and send the profiles to a profiling backend.
+
+While a hook runs, the charm's main thread is sampled with a (wall-clock) stack sampler;
+when the framework commits, the samples are exported as a single OTLP profile
+to the endpoints the charm has been given over its `charm-profiling` relation.
+Profiling is opt-in: as long as the charm has no profiling endpoint, nothing is sampled or sent.
+
+Each profile is tagged with the juju topology of the unit and with the hook (or action)
+being dispatched, in the `juju_hook` attribute.
+
+The gRPC and OTLP dependencies come with the `profiling` extra: if the charm is packed
+without it, the charm isn't profiled even if it's given profiling endpoints.
+"""
+
+from __future__ import annotations
+
+import collections
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Mapping, Optional, Type, TypeVar
+
+import ops
+
+try:
+    import grpc
+    from opentelemetry.proto.collector.profiles.v1development import (
+        profiles_service_pb2_grpc,
+    )
+
+    from profile_export import build_export_request
+except ImportError:
+    grpc = None
+
+if TYPE_CHECKING:
+    from opentelemetry.proto.collector.profiles.v1development import (
+        profiles_service_pb2,
+    )
+
+    from profile_export import Stack
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLING_INTERVAL = 0.01
+"""Seconds between two samples of the charm's stack."""
+DEFAULT_EXPORT_TIMEOUT = 5.0
+"""Seconds the export of a profile can take, before it's given up on."""
+
+_C = TypeVar("_C", bound=Type[ops.CharmBase])
+
+
+class StackSampler:
+    """Periodically sample the stack of a thread, from a background thread."""
+
+    def __init__(
+        self,
+        interval: float = DEFAULT_SAMPLING_INTERVAL,
+        thread_id: Optional[int] = None,
+    ):
+        self.interval = interval
+        self._thread_id = thread_id or threading.get_ident()
+        self._stacks: Dict[Stack, int] = collections.Counter()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._run, name="charm-profiler", daemon=True
+        )
+        self.start_time_ns = 0
+        self.duration_ns = 0
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_qualname, code.co_filename, frame.f_lineno))
+                frame = frame.f_back
+            if stack:
+                self._stacks[tuple(stack)] += 1
+
+    def start(self):
+        """Start sampling."""
+        self.start_time_ns = time.time_ns()
+        self._sampler.start()
+
+    def stop(self) -> Mapping[Stack, int]:
+        """Stop sampling, and return how many times each stack has been sampled."""
+        self._stopped.set()
+        self._sampler.join()
+        self.duration_ns = time.time_ns() - self.start_time_ns
+        return self._stacks
+
+
+def export(
+    request: profiles_service_pb2.ExportProfilesServiceRequest,
+    endpoint: str,
+    insecure: bool,
+    ca_cert: Optional[str] = None,
+    timeout: float = DEFAULT_EXPORT_TIMEOUT,
+):
+    """Send an export request to an OTLP gRPC endpoint."""
+    if insecure:
+        channel = grpc.insecure_channel(endpoint)
+    else:
+        channel = grpc.secure_channel(
+            endpoint,
+            grpc.ssl_channel_credentials(
+                root_certificates=ca_cert.encode() if ca_cert else None
+            ),
+        )
+    with channel:
+        profiles_service_pb2_grpc.ProfilesServiceStub(channel).Export(
+            request, timeout=timeout
+        )
+
+
+class _CharmProfiler(ops.Object):
+    """Export the profile of the current dispatch when the framework commits."""
+
+    def __init__(
+        self,
+        charm: ops.CharmBase,
+        sampler: StackSampler,
+        get_endpoints: Callable[[], list],
+        get_ca_cert: Callable[[], Optional[str]],
+        service_name: str,
+    ):
+        super().__init__(charm, "charm-profiler")
+        self._charm = charm
+        self._sampler = sampler
+        self._get_endpoints = get_endpoints
+        self._get_ca_cert = get_ca_cert
+        self._service_name = service_name
+        self.framework.observe(self.framework.on.commit, self._on_commit)
+
+    def _attributes(self) -> Dict[str, str]:
+        dispatch_path = os.getenv("JUJU_DISPATCH_PATH", "")
+        return {
+            "juju_model": self._charm.model.name,
+            "juju_model_uuid": self._charm.model.uuid,
+            "juju_application": self._charm.app.name,
+            "juju_unit": self._charm.unit.name,
+            "juju_charm": self._charm.meta.name,
+            "juju_hook": os.path.basename(dispatch_path),
+        }
+
+    def _build_request(
+        self, stacks: Mapping[Stack, int]
+    ) -> profiles_service_pb2.ExportProfilesServiceRequest:
+        period_ns = int(self._sampler.interval * 1e9)
+        return build_export_request(
+            ((stack, count * period_ns, {}) for stack, count in stacks.items()),
+            service_name=self._service_name,
+            sample_type="wall",
+            period=period_ns,
+            start_time_ns=self._sampler.start_time_ns,
+            duration_ns=self._sampler.duration_ns,
+            attributes=self._attributes(),
+        )
+
+    def _on_commit(self, _):
+        # profiling the charm should never make a hook fail
+        stacks = self._sampler.stop()
+        if not stacks:
+            return
+        try:
+            request = self._build_request(stacks)
+            ca_cert = self._get_ca_cert()
+            endpoints = self._get_endpoints()
+        except Exception:
+            logger.exception("failed to build the charm profile")
+            return
+        for endpoint in endpoints:
+            try:
+                export(request, endpoint.otlp_grpc, endpoint.insecure, ca_cert)
+            except Exception as e:
+                logger.warning(
+                    "failed to send the charm profile to %s: %s", endpoint.otlp_grpc, e
+                )
+
+
+def profile_charm(
+    profiling_endpoints: str,
+    server_cert: Optional[str] = None,
+    service_name: Optional[str] = None,
+    sampling_interval: float = DEFAULT_SAMPLING_INTERVAL,
+) -> Callable[[_C], _C]:
+    """Profile every dispatch of the decorated charm class.
+
+    Args:
+        profiling_endpoints: name of a charm attribute (or property) returning the list of
+            `Endpoint`s to send the profiles to. If it's empty, the charm isn't profiled.
+        server_cert: name of a charm attribute (or property) returning the CA certificate to
+            verify the profiling endpoints with, if they use TLS. Defaults to the system CAs.
+        service_name: service name to send the profiles with. Defaults to the charm name.
+        sampling_interval: seconds between two samples of the charm's stack.
+    """
+
+    def decorator(charm_type: _C) -> _C:
+        original_init = charm_type.__init__
+
+        @functools.wraps(original_init)
+        def __init__(self: ops.CharmBase, *args, **kwargs):
+            original_init(self, *args, **kwargs)
+            # the endpoints are only known once the charm is initialized: its setup isn't profiled
+            try:
+                endpoints = getattr(self, profiling_endpoints)
+            except Exception:
+                # profiling the charm should never make a hook fail
+                logger.exception("failed to get the charm profiling endpoints")
+                return
+            if not endpoints:
+                return
+            if grpc is None:
+                logger.warning(
+                    "the charm is packed without the `profiling` extra: not profiling it"
+                )
+                return
+            sampler = StackSampler(interval=sampling_interval)
+            sampler.start()
+            # keep a reference around: the framework only holds weak references to its observers
+            self._charm_profiler = _CharmProfiler(  # type: ignore
+                self,
+                sampler,
+                get_endpoints=lambda: getattr(self, profiling_endpoints),
+                get_ca_cert=lambda: getattr(self, server_cert) if server_cert else None,
+                service_name=service_name or self.meta.name,
+            )
+
+        charm_type.__init__ = __init__  # type: ignore
+        return charm_type
+
+    return decorator
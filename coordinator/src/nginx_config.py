@@ -2,11 +2,17 @@
 # See LICENSE file for licensing details.
 """Coordinator Nginx workload configuration utils."""
 
+import dataclasses
+import json
 import logging
-from typing import Dict, List
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple
 
 from charmlibs.nginx_k8s import (
+    NginxConfig,
     NginxLocationConfig,
+    NginxMapConfig,
     NginxUpstream,
 )
 
@@ -17,6 +23,45 @@ logger = logging.getLogger(__name__)
 
 grpc_server_port = 42424
 http_server_port = 8080
+# variable holding the upstream each request is routed to, for the access logs
+upstream_variable = "$pyroscope_upstream"
+# structured access logs, so that the request and upstream latencies can be aggregated
+# per upstream (e.g. with LogQL's `json` parser and `unwrap`) once the logs are forwarded to Loki.
+# The upstream timings are strings: they are "-" if the request wasn't proxied,
+# and a comma-separated list if nginx retried the request on another upstream server.
+access_log_format_name = "timed"
+access_log_format = json.dumps(
+    {
+        "time": "$time_iso8601",
+        "remote_addr": "$remote_addr",
+        "request_method": "$request_method",
+        "uri": "$uri",
+        "status": "$status",
+        "request_length": "$request_length",
+        "body_bytes_sent": "$body_bytes_sent",
+        "request_time": "$request_time",
+        "upstream": upstream_variable,
+        "upstream_addr": "$upstream_addr",
+        "upstream_status": "$upstream_status",
+        "upstream_connect_time": "$upstream_connect_time",
+        "upstream_header_time": "$upstream_header_time",
+        "upstream_response_time": "$upstream_response_time",
+    }
+)
+
+# nginx defaults to 5 worker processes with 4096 connections each; with resources limits,
+# fewer are spawned so that they fit in them.
+default_worker_processes = 5
+default_worker_connections = 4096
+# rough memory footprint of a proxied connection (buffers and connection state), to size the
+# number of connections on the memory limit
+connection_memory_bytes = 64 * 2**10
+min_worker_connections = 512
+# nginx's default: the most requests a client can send at once over a single (grpc) connection
+http2_max_concurrent_streams = 128
+# multipliers of the nginx size suffixes
+size_units = {"": 1, "k": 2**10, "m": 2**20, "g": 2**30}
+
 # e2e TLS in upstream is not supported yet, so we can only support TLS termination at nginx
 # https://github.com/grafana/pyroscope/issues/3598
 upstream_tls = False
@@ -69,11 +114,111 @@ def upstreams(pyroscope_port: int) -> List[NginxUpstream]:
     return upstreams
 
 
-def server_ports_to_locations() -> Dict[int, List[NginxLocationConfig]]:
+def upstream_map_config() -> NginxMapConfig:
+    """Generate the `map` from request paths to the upstream serving them, mirroring the locations."""
+    value_mappings: Dict[str, List[str]] = {}
+    for location in (*http_locations, *grpc_locations):
+        if location.modifier == "=":
+            key = location.path
+        else:
+            key = f"~^{re.escape(location.path)}"
+        value_mappings[key] = [location.backend]
+    value_mappings["default"] = ["-"]
+    return NginxMapConfig(
+        source_variable="$uri",
+        target_variable=upstream_variable,
+        value_mappings=value_mappings,
+    )
+
+
+def worker_tuning(
+    cpu_limit: Optional[float],
+    memory_limit: Optional[float],
+    worker_processes: Optional[int] = None,
+) -> Tuple[int, int]:
+    """Return the number of worker processes and of connections per worker fitting the resources limits.
+
+    Args:
+        cpu_limit: the cpu limit of the nginx container, in cores, if any.
+        memory_limit: the memory limit of the nginx container, in bytes, if any.
+        worker_processes: the number of worker processes, if set by the user.
+    """
+    if not worker_processes:
+        worker_processes = default_worker_processes
+        if cpu_limit:
+            # one worker process per core: more would only compete for the cpu quota
+            worker_processes = max(1, min(worker_processes, math.ceil(cpu_limit)))
+    worker_connections = default_worker_connections
+    if memory_limit:
+        worker_connections = max(
+            min_worker_connections,
+            min(
+                worker_connections,
+                int(memory_limit / connection_memory_bytes / worker_processes),
+            ),
+        )
+    return worker_processes, worker_connections
+
+
+def size_bytes(size: str) -> int:
+    """Convert an nginx size (e.g. "32m") to bytes."""
+    unit = size[-1:].lower() if size[-1:].isalpha() else ""
+    return int(size[: len(size) - len(unit)]) * size_units[unit]
+
+
+class PyroscopeNginxConfig(NginxConfig):
+    """Nginx configuration that writes structured access logs with the request and upstream timings.
+
+    The locations log in that format (see `location_directives`), but `log_format` is only valid
+    in the `http` block, which the lib takes no extra directives for: it's added at the top of
+    the block in the rendered config.
+    """
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(map_configs=[upstream_map_config()], **kwargs)
+
+    def get_config(self, *args: Any, **kwargs: Any) -> str:
+        """Render the Nginx configuration as a string, with the access logs format."""
+        config = super().get_config(*args, **kwargs)
+        head, http, block = config.partition("http {\n")
+        if not http:
+            raise ValueError("no http block in the rendered nginx config")
+        log_format = (
+            f"log_format {access_log_format_name} escape=json '{access_log_format}';"
+        )
+        return f"{head}{http}    {log_format}\n{block}"
+
+
+def location_directives(
+    client_max_body_size: str = "32m", proxy_buffer_size: str = "16k"
+) -> Dict[str, List[str]]:
+    """Generate the directives each location proxying to the workers is configured with."""
+    return {
+        "access_log": ["/dev/stderr", access_log_format_name],
+        # profiles are uploaded in a single request, which nginx limits to 1m by default
+        "client_max_body_size": [client_max_body_size],
+        # query responses (e.g. flame graphs) outgrow the default (one page) buffers
+        "proxy_buffer_size": [proxy_buffer_size],
+        "proxy_buffers": ["8", proxy_buffer_size],
+    }
+
+
+def server_ports_to_locations(
+    client_max_body_size: str = "32m", proxy_buffer_size: str = "16k"
+) -> Dict[int, List[NginxLocationConfig]]:
     """Generate a mapping from server ports to a list of Nginx location configurations."""
+    directives = location_directives(client_max_body_size, proxy_buffer_size)
+
+    def configured(locations: List[NginxLocationConfig]) -> List[NginxLocationConfig]:
+        return [
+            dataclasses.replace(
+                location, extra_directives={**location.extra_directives, **directives}
+            )
+            for location in locations
+        ]
 
     # send http(s) traffic to the http locations; grpc to grpc
     return {
-        http_server_port: http_locations,
-        grpc_server_port: grpc_locations,
+        http_server_port: configured(http_locations),
+        grpc_server_port: configured(grpc_locations),
     }
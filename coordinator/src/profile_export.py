@@ -0,0 +1,148 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Build OTLP profiles export requests.
+
+Shared by the charm, to export the profiles of its own hooks, and by `scripts/profilegen.py`,
+to generate synthetic profiles: it only depends on the OTLP protobufs.
+"""
+
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+
+from opentelemetry.proto.collector.profiles.v1development import profiles_service_pb2
+from opentelemetry.proto.common.v1 import common_pb2
+from opentelemetry.proto.profiles.v1development import profiles_pb2
+from opentelemetry.proto.resource.v1 import resource_pb2
+
+Frame = Tuple[str, str, int]
+"""A stack frame, as (function name, file name, line number)."""
+Stack = Tuple[Frame, ...]
+"""A stack, leaf frame first."""
+Sample = Tuple[Stack, int, Mapping[str, str]]
+"""A sample, as (stack, value, labels)."""
+
+
+def build_export_request(
+    samples: Iterable[Sample],
+    service_name: str,
+    sample_type: str,
+    period: int,
+    start_time_ns: int,
+    duration_ns: int,
+    attributes: Optional[Dict[str, str]] = None,
+    sample_unit: str = "nanoseconds",
+) -> profiles_service_pb2.ExportProfilesServiceRequest:
+    """Build an OTLP export request carrying a single profile of the samples.
+
+    Functions, locations, stacks and labels are deduplicated in the profiles dictionary.
+    """
+    # index 0 of every table is the zero value, by convention
+    string_table = [""]
+    strindices: Dict[str, int] = {}
+    functions = [profiles_pb2.Function()]
+    function_indices: Dict[Tuple[str, str], int] = {}
+    locations = [profiles_pb2.Location()]
+    location_indices: Dict[Frame, int] = {}
+    stack_table = [profiles_pb2.Stack()]
+    stack_indices: Dict[Stack, int] = {}
+    attribute_table = [profiles_pb2.KeyValueAndUnit()]
+    attribute_indices: Dict[Tuple[str, str], int] = {}
+
+    def strindex(s: str) -> int:
+        if s not in strindices:
+            strindices[s] = len(string_table)
+            string_table.append(s)
+        return strindices[s]
+
+    def location_index(frame: Frame) -> int:
+        if frame not in location_indices:
+            name, filename, line = frame
+            if (name, filename) not in function_indices:
+                function_indices[name, filename] = len(functions)
+                functions.append(
+                    profiles_pb2.Function(
+                        name_strindex=strindex(name),
+                        filename_strindex=strindex(filename),
+                    )
+                )
+            location_indices[frame] = len(locations)
+            locations.append(
+                profiles_pb2.Location(
+                    mapping_index=0,
+                    lines=[
+                        profiles_pb2.Line(
+                            function_index=function_indices[name, filename],
+                            line=line,
+                        )
+                    ],
+                )
+            )
+        return location_indices[frame]
+
+    def stack_index(stack: Stack) -> int:
+        if stack not in stack_indices:
+            stack_indices[stack] = len(stack_table)
+            stack_table.append(
+                profiles_pb2.Stack(
+                    location_indices=[location_index(frame) for frame in stack]
+                )
+            )
+        return stack_indices[stack]
+
+    def attribute_index(key: str, value: str) -> int:
+        if (key, value) not in attribute_indices:
+            attribute_indices[key, value] = len(attribute_table)
+            attribute_table.append(
+                profiles_pb2.KeyValueAndUnit(
+                    key_strindex=strindex(key),
+                    value=common_pb2.AnyValue(string_value=value),
+                )
+            )
+        return attribute_indices[key, value]
+
+    value_type = profiles_pb2.ValueType(
+        type_strindex=strindex(sample_type),
+        unit_strindex=strindex(sample_unit),
+    )
+    profile = profiles_pb2.Profile(
+        sample_type=value_type,
+        samples=[
+            profiles_pb2.Sample(
+                stack_index=stack_index(stack),
+                values=[value],
+                attribute_indices=[
+                    attribute_index(key, label) for key, label in labels.items()
+                ],
+            )
+            for stack, value, labels in samples
+        ],
+        period_type=value_type,
+        period=period,
+        time_unix_nano=start_time_ns,
+        duration_nano=duration_ns,
+    )
+    resource = resource_pb2.Resource(
+        attributes=[
+            common_pb2.KeyValue(key=key, value=common_pb2.AnyValue(string_value=value))
+            for key, value in {
+                "service.name": service_name,
+                **(attributes or {}),
+            }.items()
+        ]
+    )
+    return profiles_service_pb2.ExportProfilesServiceRequest(
+        resource_profiles=[
+            profiles_pb2.ResourceProfiles(
+                resource=resource,
+                scope_profiles=[profiles_pb2.ScopeProfiles(profiles=[profile])],
+            )
+        ],
+        dictionary=profiles_pb2.ProfilesDictionary(
+            string_table=string_table,
+            mapping_table=[profiles_pb2.Mapping()],
+            function_table=functions,
+            location_table=locations,
+            stack_table=stack_table,
+            attribute_table=attribute_table,
+        ),
+    )
@@ -4,7 +4,9 @@
 
 """Pyroscope workload configuration and client."""
 
-from typing import Dict, Optional, Set, Tuple
+import math
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
 from urllib.parse import urlparse
 
 import yaml
@@ -13,6 +15,24 @@ from coordinated_workers.coordinator import Coordinator
 import pyroscope_config
 from charm_config import CharmConfig
 
+# the s3 relation's `s3-uri-style`, to how the Pyroscope s3 client addresses the bucket
+S3_URI_STYLE_TO_BUCKET_LOOKUP_TYPE = {
+    "path": "path",
+    "host": "virtual-hosted",
+}
+# Pyroscope only accepts digits and letters in the storage prefix
+INVALID_STORAGE_PREFIX_CHARACTERS = re.compile(r"[^0-9a-zA-Z]")
+# upstream defaults, which the query path settings never go below
+MIN_MAX_OUTSTANDING_REQUESTS_PER_TENANT = 100
+MIN_SCHEDULER_WORKER_CONCURRENCY = 5
+# how many times over each query-scheduler can queue the queries all the queriers can run at once
+QUERY_SCHEDULER_QUEUE_DEPTH = 2
+# upstream default of the distributors' `max_profile_size_bytes` limit, which the charm doesn't override:
+# larger profiles are rejected
+MAX_PROFILE_SIZE_BYTES = 4 * 2**20
+# how the workers sample the traces of their requests, unless configured otherwise: all of them
+DEFAULT_WORKLOAD_TRACING_SAMPLER = {"type": "const", "param": 1.0}
+
 
 class Pyroscope:
     """Class representing the Pyroscope client workload configuration."""
@@ -23,6 +43,13 @@ class Pyroscope:
     memberlist_port = 7946
     # this is an http server, but it can also somehow accept grpc traffic using some dark trick
     http_server_port = 4040
+    # where the workers write the runtime config (the per-tenant overrides) the coordinator publishes
+    runtime_config_path = "/etc/worker/runtime-config.yaml"
+    # key of the worker config holding the settings of the worker charm, which aren't part of
+    # the Pyroscope config: the workers remove it before writing the config to disk
+    worker_charm_config_key = "charm"
+    # service name Pyroscope pushes its own profiles with, when self-profiling is enabled
+    self_profiling_service_name = "pyroscope"
 
     def __init__(
         self,
@@ -46,14 +73,45 @@ class Pyroscope:
             ingester=self._build_ingester_config(addrs_by_role),
             store_gateway=self._build_store_gateway_config(addrs_by_role),
             memberlist=self._build_memberlist_config(addrs),
-            limits=self._build_limits_config(),
-            storage=self._build_storage_config(coordinator._s3_config),
+            limits=self._build_limits_config(coordinator, addrs_by_role),
+            # workers that predate the runtime config don't write it: only point to it when needed
+            runtime_config=pyroscope_config.RuntimeConfig(file=self.runtime_config_path)
+            if self._charm_config.retention_overrides
+            else None,
+            storage=self._build_storage_config(
+                coordinator._s3_config,
+                coordinator.s3_requirer.get_s3_connection_info(),
+            ),
             compactor=self._build_compactor_config(),
+            query_scheduler=self._build_query_scheduler_config(addrs_by_role),
+            frontend=self._build_frontend_config(addrs_by_role),
+            frontend_worker=self._build_frontend_worker_config(),
             pyroscopedb=self._build_pyroscope_db(),
+            self_profiling=self._build_self_profiling_config(),
         )
-        return yaml.dump(
-            config.model_dump(mode="json", by_alias=True, exclude_none=True)
-        )
+        worker_config = config.model_dump(mode="json", by_alias=True, exclude_none=True)
+        if worker_charm_config := self._build_worker_charm_config():
+            worker_config[self.worker_charm_config_key] = worker_charm_config
+        return yaml.dump(worker_config)
+
+    def _build_worker_charm_config(self) -> Dict[str, Any]:
+        """Generate the settings of the worker charm, distributed along with the Pyroscope config.
+
+        Workers that predate these settings would hand them over to Pyroscope, which refuses
+        unknown keys: they're only set when they differ from the defaults.
+        """
+        charm_config = {}
+        sampler: Dict[str, Any] = {
+            "type": self._charm_config.workload_tracing_sampler_type,
+            "param": self._charm_config.workload_tracing_sampler_param,
+        }
+        if server_url := self._charm_config.workload_tracing_sampling_server_url:
+            sampler["server_url"] = server_url
+        if sampler != DEFAULT_WORKLOAD_TRACING_SAMPLER:
+            charm_config["workload_tracing_sampler"] = sampler
+        if runtime_config := self._build_runtime_config():
+            charm_config["runtime_config"] = runtime_config
+        return charm_config
 
     def _build_server_config(self):
         return pyroscope_config.Server(
@@ -68,8 +126,9 @@ class Pyroscope:
         return pyroscope_config.Ingester(
             lifecycler=pyroscope_config.Lifecycler(
                 ring=pyroscope_config.Ring(
-                    replication_factor=3
-                    if ingester_addresses and len(ingester_addresses) >= 3
+                    replication_factor=pyroscope_config.REPLICATION_FACTOR
+                    if ingester_addresses
+                    and len(ingester_addresses) >= pyroscope_config.REPLICATION_FACTOR
                     else 1,
                     kvstore=pyroscope_config.Kvstore(
                         store="memberlist",
@@ -85,8 +144,9 @@ class Pyroscope:
         )
         return pyroscope_config.StoreGateway(
             sharding_ring=pyroscope_config.ShardingRing(
-                replication_factor=3
-                if store_gw_addresses and len(store_gw_addresses) >= 3
+                replication_factor=pyroscope_config.REPLICATION_FACTOR
+                if store_gw_addresses
+                and len(store_gw_addresses) >= pyroscope_config.REPLICATION_FACTOR
                 else 1,
             )
         )
@@ -101,19 +161,135 @@ class Pyroscope:
             ),
         )
 
-    def _build_limits_config(self):
+    def _build_limits_config(
+        self, coordinator: Coordinator, roles_addresses: Dict[str, Set[str]]
+    ):
         return pyroscope_config.Limits(
-            compactor_blocks_retention_period=0
-            if self._charm_config.retention_period == "0"
-            else self._charm_config.retention_period
+            compactor_blocks_retention_period=_retention_period(
+                self._charm_config.retention_period
+            ),
+            # only override the upstream default (disabled) when enabled
+            compactor_downsampler_enabled=self._charm_config.compactor_downsampling
+            or None,
+            ingestion_relabeling_rules=self._self_profiling_relabeling_rules(
+                coordinator, roles_addresses
+            )
+            if self._charm_config.self_profiling
+            else None,
         )
 
-    @staticmethod
-    def _build_storage_config(s3_config: dict):
+    def _build_runtime_config(self) -> Optional[Dict[str, Any]]:
+        """Generate the runtime config of the workers, holding the per-tenant overrides.
+
+        None if no tenant overrides its limits: the workers run without a runtime config.
+        """
+        if not self._charm_config.retention_overrides:
+            return None
+        config = pyroscope_config.RuntimeOverrides(
+            overrides={
+                tenant: pyroscope_config.TenantLimits(
+                    compactor_blocks_retention_period=_retention_period(period)
+                )
+                for tenant, period in self._charm_config.retention_overrides.items()
+            }
+        )
+        return config.model_dump(mode="json")
+
+    def _self_profiling_relabeling_rules(
+        self, coordinator: Coordinator, roles_addresses: Dict[str, Set[str]]
+    ) -> List[pyroscope_config.RelabelConfig]:
+        """Label the workers' own profiles with their juju topology and roles.
+
+        Pyroscope only tags its own profiles with the `hostname` of the worker, i.e. the pod name,
+        from which the juju unit can be inferred.
+        """
+        service_name = self.self_profiling_service_name
+        rules = [
+            pyroscope_config.RelabelConfig(
+                source_labels=["service_name"],
+                regex=service_name,
+                target_label=label,
+                replacement=value,
+            )
+            for label, value in (
+                ("juju_model", coordinator.model.name),
+                ("juju_model_uuid", coordinator.model.uuid),
+            )
+        ]
+
+        roles_by_app: Dict[str, Set[str]] = {}
+        for worker in coordinator.cluster.gather_topology():
+            roles_by_app.setdefault(worker["application"], set()).update(
+                role
+                for role, addresses in roles_addresses.items()
+                if worker["address"] in addresses
+            )
+        for app, roles in sorted(roles_by_app.items()):
+            if roles >= pyroscope_config.PyroscopeRole.all_nonmeta():
+                roles = {pyroscope_config.PyroscopeRole.all}
+            regex = f"{service_name};{re.escape(app)}-([0-9]+)"
+            rules.extend(
+                pyroscope_config.RelabelConfig(
+                    source_labels=["service_name", "hostname"],
+                    regex=regex,
+                    target_label=label,
+                    replacement=value,
+                )
+                for label, value in (
+                    ("juju_application", app),
+                    ("juju_unit", f"{app}/$1"),
+                    ("roles", ",".join(sorted(roles))),
+                )
+            )
+        return rules
+
+    def _build_self_profiling_config(self) -> Optional[pyroscope_config.SelfProfiling]:
+        if self._charm_config.self_profiling is None:
+            return None
+        return pyroscope_config.SelfProfiling(
+            disable_push=not self._charm_config.self_profiling
+        )
+
+    def _build_storage_config(self, s3_config: dict, s3_connection_info: dict):
+        charm_config = self._charm_config
+        http = pyroscope_config.S3HTTP(
+            idle_conn_timeout=charm_config.s3_idle_connection_timeout,
+            response_header_timeout=charm_config.s3_response_header_timeout,
+            max_idle_connections_per_host=charm_config.s3_max_idle_connections_per_host,
+            max_connections_per_host=charm_config.s3_max_connections_per_host,
+        )
         return pyroscope_config.Storage(
-            backend="s3", s3=pyroscope_config.S3Storage(**s3_config)
+            backend="s3",
+            s3=pyroscope_config.S3Storage(
+                **s3_config,
+                bucket_lookup_type=S3_URI_STYLE_TO_BUCKET_LOOKUP_TYPE.get(
+                    s3_connection_info.get("s3-uri-style", "")
+                ),
+                sse=(
+                    pyroscope_config.SSE(
+                        type=charm_config.s3_sse_type,
+                        kms_key_id=charm_config.s3_sse_kms_key_id,
+                    )
+                    if charm_config.s3_sse_type
+                    else None
+                ),
+                # only override the upstream defaults that have been configured
+                http=http if http.model_dump(exclude_none=True) else None,
+            ),
+            prefix=self._storage_prefix(s3_connection_info.get("path")),
         )
 
+    def _storage_prefix(self, s3_path: Optional[str]) -> Optional[str]:
+        """The prefix of the objects in the bucket, so that Pyroscope clusters can share one bucket.
+
+        The storage_prefix config option takes precedence over the path of the s3 relation.
+        """
+        if prefix := self._charm_config.storage_prefix:
+            return prefix
+        if s3_path:
+            return INVALID_STORAGE_PREFIX_CHARACTERS.sub("", s3_path) or None
+        return None
+
     def _build_compactor_config(self):
         return pyroscope_config.Compactor(
             cleanup_interval=self._charm_config.cleanup_interval,
@@ -127,6 +303,53 @@ class Pyroscope:
             ),
         )
 
+    @staticmethod
+    def _role_count(roles_addresses: Dict[str, Set[str]], role: str) -> int:
+        return max(1, len(roles_addresses.get(role, ())))
+
+    def _querier_concurrency(self, roles_addresses: Dict[str, Set[str]]) -> int:
+        """The number of queries all the queriers can run at once."""
+        return (
+            self._role_count(roles_addresses, pyroscope_config.PyroscopeRole.querier)
+            * self._charm_config.querier_max_concurrency
+        )
+
+    def _build_query_scheduler_config(self, roles_addresses: Dict[str, Set[str]]):
+        # every querier pulls queries from every query-scheduler
+        schedulers = self._role_count(
+            roles_addresses, pyroscope_config.PyroscopeRole.query_scheduler
+        )
+        return pyroscope_config.QueryScheduler(
+            max_outstanding_requests_per_tenant=max(
+                MIN_MAX_OUTSTANDING_REQUESTS_PER_TENANT,
+                math.ceil(
+                    QUERY_SCHEDULER_QUEUE_DEPTH
+                    * self._querier_concurrency(roles_addresses)
+                    / schedulers
+                ),
+            )
+        )
+
+    def _build_frontend_config(self, roles_addresses: Dict[str, Set[str]]):
+        # each query-frontend forwards the queries to each query-scheduler over this many
+        # connections: together, they have to keep up with the queriers
+        connections = self._role_count(
+            roles_addresses, pyroscope_config.PyroscopeRole.query_frontend
+        ) * self._role_count(
+            roles_addresses, pyroscope_config.PyroscopeRole.query_scheduler
+        )
+        return pyroscope_config.Frontend(
+            scheduler_worker_concurrency=max(
+                MIN_SCHEDULER_WORKER_CONCURRENCY,
+                math.ceil(self._querier_concurrency(roles_addresses) / connections),
+            )
+        )
+
+    def _build_frontend_worker_config(self):
+        return pyroscope_config.FrontendWorker(
+            max_concurrent=self._charm_config.querier_max_concurrency
+        )
+
     def _build_pyroscope_db(self):
         return pyroscope_config.DB(data_path=self._data_path)
 
@@ -152,3 +375,8 @@ class Pyroscope:
     @staticmethod
     def _base_url(external_url):
         return urlparse(external_url).path
+
+
+def _retention_period(period: str) -> str | int:
+    # Pyroscope only takes an unquoted 0 to disable the retention
+    return 0 if period == "0" else period
@@ -4,7 +4,7 @@
 """Helper module for interacting with the Pyroscope configuration."""
 
 from enum import StrEnum, unique
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from coordinated_workers.coordinator import ClusterRolesConfig
 from pydantic import BaseModel, Field
@@ -73,6 +73,10 @@ PYROSCOPE_ROLES_CONFIG = ClusterRolesConfig(
 )
 # Define the configuration for Pyroscope roles.
 
+REPLICATION_FACTOR = 3
+# The replication factor of the ingester and store-gateway rings, once there are enough
+# units of the role to replicate the data to.
+
 
 class Kvstore(BaseModel):
     """Kvstore schema."""
@@ -140,6 +144,22 @@ class Memberlist(BaseModel):
     join_members: List[str]
 
 
+class SSE(BaseModel):
+    """S3 server-side encryption schema."""
+
+    type: str
+    kms_key_id: Optional[str] = None
+
+
+class S3HTTP(BaseModel):
+    """S3 HTTP client schema."""
+
+    idle_conn_timeout: Optional[str] = None
+    response_header_timeout: Optional[str] = None
+    max_idle_connections_per_host: Optional[int] = None
+    max_connections_per_host: Optional[int] = None
+
+
 class S3Storage(BaseModel):
     """S3 Storage schema"""
 
@@ -149,6 +169,9 @@ class S3Storage(BaseModel):
     secret_access_key: str
     region: Optional[str] = None
     insecure: bool = False
+    bucket_lookup_type: Optional[str] = None
+    sse: Optional[SSE] = None
+    http: Optional[S3HTTP] = None
 
 
 class Storage(BaseModel):
@@ -156,6 +179,7 @@ class Storage(BaseModel):
 
     backend: str
     s3: S3Storage
+    prefix: Optional[str] = None
 
 
 class Distributor(BaseModel):
@@ -172,16 +196,71 @@ class Compactor(BaseModel):
     sharding_ring: ShardingRingCompactor
 
 
+class QueryScheduler(BaseModel):
+    """QueryScheduler schema."""
+
+    max_outstanding_requests_per_tenant: int
+
+
+class Frontend(BaseModel):
+    """Query-frontend schema."""
+
+    scheduler_worker_concurrency: int
+
+
+class FrontendWorker(BaseModel):
+    """Querier worker schema, i.e. how the queriers pull the queries from the query-schedulers."""
+
+    max_concurrent: int
+
+
 class DB(BaseModel):
     """Pyroscope DB schema."""
 
     data_path: str
 
 
+class RelabelConfig(BaseModel):
+    """Relabeling rule schema."""
+
+    source_labels: List[str]
+    regex: str
+    target_label: str
+    replacement: str
+    action: str = "replace"
+
+
 class Limits(BaseModel):
     """Limits schema."""
 
     compactor_blocks_retention_period: str | int = "1d"
+    compactor_downsampler_enabled: Optional[bool] = None
+    ingestion_relabeling_rules: Optional[List[RelabelConfig]] = None
+
+
+class TenantLimits(BaseModel):
+    """Per-tenant limits schema, overriding the `limits` of the tenant."""
+
+    compactor_blocks_retention_period: str | int
+
+
+class RuntimeOverrides(BaseModel):
+    """Runtime config file schema."""
+
+    overrides: Dict[str, TenantLimits] = {}
+
+
+class RuntimeConfig(BaseModel):
+    """Runtime config schema: the file the per-tenant overrides are periodically reloaded from."""
+
+    file: str
+    period: Optional[str] = None
+
+
+class SelfProfiling(BaseModel):
+    """Self-profiling schema."""
+
+    disable_push: Optional[bool] = None
 
 
 class PyroscopeConfig(BaseModel):
@@ -194,6 +273,11 @@ class PyroscopeConfig(BaseModel):
     store_gateway: StoreGateway
     memberlist: Memberlist
     limits: Limits
+    runtime_config: Optional[RuntimeConfig] = None
     storage: Storage
     compactor: Compactor
+    query_scheduler: QueryScheduler
+    frontend: Frontend
+    frontend_worker: FrontendWorker
     pyroscopedb: DB
+    self_profiling: Optional[SelfProfiling] = None
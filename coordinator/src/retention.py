@@ -0,0 +1,68 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Retention periods of the Pyroscope tenants, and estimates of the storage they take."""
+
+from dataclasses import asdict, dataclass
+
+# seconds in each unit of a retention period (cfr. TIMESPEC_REGEXP)
+_TIMESPEC_UNITS = {
+    "ms": 0.001,
+    "s": 1,
+    "m": 60,
+    "h": 60 * 60,
+    "d": 24 * 60 * 60,
+    "w": 7 * 24 * 60 * 60,
+    "y": 365 * 24 * 60 * 60,
+}
+
+
+def timespec_seconds(period: str) -> float | None:
+    """Convert a retention period (e.g. "30d") to seconds; None if the retention is disabled ("0")."""
+    if period == "0":
+        return None
+    unit = "ms" if period.endswith("ms") else period[-1]
+    return int(period[: -len(unit)]) * _TIMESPEC_UNITS[unit]
+
+
+@dataclass
+class TenantRetention:
+    """The retention period of a tenant, and the storage its profiles take."""
+
+    tenant: str
+    retention_period: str
+    overridden: bool
+    ingest_bytes_per_second: float | None = None
+    # None if the ingest rate is unknown, or the profiles are never deleted
+    estimated_bytes: int | None = None
+
+    def to_dict(self) -> dict:
+        """Return the fields that are set, as a dict."""
+        return {key: value for key, value in asdict(self).items() if value is not None}
+
+
+def list_retention(
+    retention_period: str,
+    overrides: dict[str, str],
+    ingest_rates: dict[str, float],
+) -> list[TenantRetention]:
+    """List the retention of the tenants with an override, or with an ingest rate.
+
+    Args:
+        retention_period: the retention period of the tenants without an override.
+        overrides: the retention periods of the tenants with an override, by tenant.
+        ingest_rates: the bytes per second each tenant ingests, by tenant.
+    """
+    out = []
+    for tenant in sorted(set(overrides) | set(ingest_rates)):
+        retention = TenantRetention(
+            tenant=tenant,
+            retention_period=overrides.get(tenant, retention_period),
+            overridden=tenant in overrides,
+        )
+        if (rate := ingest_rates.get(tenant)) is not None:
+            retention.ingest_bytes_per_second = rate
+            if (seconds := timespec_seconds(retention.retention_period)) is not None:
+                retention.estimated_bytes = int(rate * seconds)
+        out.append(retention)
+    return out
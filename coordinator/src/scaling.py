@@ -0,0 +1,284 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Scaling recommendations for a Pyroscope cluster, based on live worker metrics."""
+
+import logging
+import math
+import re
+import time
+import urllib.request
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+from pyroscope_config import REPLICATION_FACTOR, PyroscopeRole
+
+logger = logging.getLogger(__name__)
+
+# Per-unit capacity targets used to translate the observed load into unit counts.
+# They are intentionally conservative: the recommendation is a starting point for
+# the cloud admin, not an autoscaler.
+DISTRIBUTOR_TARGET_BYTES_PER_SECOND = 8 * 1024 * 1024
+INGESTER_TARGET_HEAP_BYTES = 2 * 1024 * 1024 * 1024
+INGESTER_TARGET_SERIES = 500_000
+QUERIER_TARGET_P99_SECONDS = 1.0
+COMPACTOR_TARGET_PENDING_TENANTS = 1
+# don't let a single stuck compaction run trigger a scale-out of the whole role
+COMPACTOR_MAX_EXTRA_UNITS = 2
+# pyroscope's default `compactor.compaction_interval`
+COMPACTION_INTERVAL_SECONDS = 60 * 60
+
+# routes that are served by the read path (cfr. the read alerts in prometheus_alert_rules)
+READ_ROUTES_REGEX = re.compile(r"^pyroscope_render.*")
+
+_SAMPLE_REGEX = re.compile(
+    r"^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?P<labels>.*)\})?\s+(?P<value>\S+)"
+)
+_LABEL_REGEX = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+@dataclass(frozen=True)
+class Sample:
+    """A single sample from a Prometheus text exposition."""
+
+    name: str
+    labels: tuple[tuple[str, str], ...]
+    value: float
+
+    def label(self, key: str) -> str | None:
+        """Return the value of a label, if set."""
+        return dict(self.labels).get(key)
+
+
+Metrics = dict[str, list[Sample]]
+"""Samples from a metrics endpoint, grouped by metric name."""
+
+
+def parse_metrics(text: str) -> Metrics:
+    """Parse a Prometheus text exposition into samples grouped by metric name."""
+    metrics: Metrics = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE_REGEX.match(line)
+        if not match:
+            continue
+        try:
+            value = float(match.group("value"))
+        except ValueError:
+            continue
+        labels = tuple(sorted(_LABEL_REGEX.findall(match.group("labels") or "")))
+        metrics.setdefault(match.group("name"), []).append(
+            Sample(match.group("name"), labels, value)
+        )
+    return metrics
+
+
+def scrape(url: str, timeout: float = 5) -> Metrics | None:
+    """Fetch and parse a metrics endpoint; return None if it can't be reached."""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return parse_metrics(response.read().decode("utf-8"))
+    except (OSError, ValueError) as e:
+        logger.warning("failed to scrape %s: %s", url, e)
+        return None
+
+
+@dataclass
+class ClusterSample:
+    """Two scrapes of every worker, taken `interval` seconds apart."""
+
+    interval: float
+    before: dict[str, Metrics] = field(default_factory=dict)
+    after: dict[str, Metrics] = field(default_factory=dict)
+    unreachable: set[str] = field(default_factory=set)
+    timestamp: float = field(default_factory=time.time)
+
+    @staticmethod
+    def _sum(
+        metrics: dict[str, Metrics],
+        addresses: Iterable[str],
+        name: str,
+        route: re.Pattern | None = None,
+    ) -> dict[tuple[tuple[str, str], ...], float]:
+        """Sum a metric over a set of workers, keeping the `le` label apart."""
+        out: dict[tuple[tuple[str, str], ...], float] = {}
+        for address in addresses:
+            for sample in metrics.get(address, {}).get(name, []):
+                if route and not route.match(sample.label("route") or ""):
+                    continue
+                key = (("le", le),) if (le := sample.label("le")) is not None else ()
+                out[key] = out.get(key, 0.0) + sample.value
+        return out
+
+    def gauge(self, addresses: Iterable[str], name: str) -> float:
+        """Sum of a gauge over a set of workers, as of the last scrape."""
+        return sum(self._sum(self.after, addresses, name).values())
+
+    def rate(self, addresses: Iterable[str], name: str) -> float:
+        """Per-second increase of a counter summed over a set of workers."""
+        addresses = tuple(addresses)
+        before = sum(self._sum(self.before, addresses, name).values())
+        after = sum(self._sum(self.after, addresses, name).values())
+        # a counter reset (i.e. a worker restart) would yield a negative delta
+        return max(after - before, 0.0) / self.interval
+
+    def rate_by(
+        self, addresses: Iterable[str], name: str, label: str
+    ) -> dict[str, float]:
+        """Per-second increase of a counter summed over a set of workers, by the value of a label."""
+        increases: dict[str, float] = {}
+        for address in addresses:
+            before = {
+                sample.labels: sample.value
+                for sample in self.before.get(address, {}).get(name, [])
+            }
+            for sample in self.after.get(address, {}).get(name, []):
+                if (value := sample.label(label)) is None:
+                    continue
+                # a counter reset (i.e. a worker restart) would yield a negative delta
+                increase = max(sample.value - before.get(sample.labels, 0.0), 0.0)
+                increases[value] = increases.get(value, 0.0) + increase
+        return {
+            value: increase / self.interval for value, increase in increases.items()
+        }
+
+    def quantile(
+        self, addresses: Iterable[str], name: str, q: float, route: re.Pattern
+    ) -> float | None:
+        """Estimate a quantile from the increase of a histogram; None if nothing was observed."""
+        addresses = tuple(addresses)
+        before = self._sum(self.before, addresses, f"{name}_bucket", route)
+        after = self._sum(self.after, addresses, f"{name}_bucket", route)
+        buckets = sorted(
+            (float(dict(key)["le"]), max(value - before.get(key, 0.0), 0.0))
+            for key, value in after.items()
+        )
+        if not buckets or buckets[-1][1] <= 0:
+            return None
+
+        rank = q * buckets[-1][1]
+        lower_bound, lower_count = 0.0, 0.0
+        for upper_bound, count in buckets:
+            if count >= rank:
+                if math.isinf(upper_bound):
+                    # same as prometheus' histogram_quantile: return the highest finite bucket
+                    return lower_bound
+                if count == lower_count:
+                    return upper_bound
+                # linear interpolation within the bucket
+                return lower_bound + (upper_bound - lower_bound) * (
+                    (rank - lower_count) / (count - lower_count)
+                )
+            lower_bound, lower_count = upper_bound, count
+        return lower_bound
+
+
+def sample_cluster(
+    addresses: Iterable[str], port: int, interval: float, timeout: float = 5
+) -> ClusterSample:
+    """Scrape all workers twice, `interval` seconds apart."""
+    sample = ClusterSample(interval=interval)
+    addresses = sorted(set(addresses))
+    for scrapes in (sample.before, sample.after):
+        if scrapes is sample.after:
+            time.sleep(interval)
+        for address in addresses:
+            if address in sample.unreachable:
+                continue
+            metrics = scrape(f"http://{address}:{port}/metrics", timeout=timeout)
+            if metrics is None:
+                sample.unreachable.add(address)
+                continue
+            scrapes[address] = metrics
+    sample.timestamp = time.time()
+    return sample
+
+
+def _ceil_units(load: float, target: float) -> int:
+    return max(1, math.ceil(load / target))
+
+
+def _compactor_backlog(sample: ClusterSample, address: str) -> float:
+    """Tenants a compactor has left pending for longer than a compaction interval.
+
+    The tenant gauges are reset at the start of each compaction run, so the tenants still
+    pending while a run is in progress aren't a backlog, unless the compactor hasn't
+    completed a run (or started, if it never has) in over a compaction interval.
+    """
+    addresses = (address,)
+    pending = (
+        sample.gauge(addresses, "pyroscope_compactor_tenants_discovered")
+        - sample.gauge(addresses, "pyroscope_compactor_tenants_processing_succeeded")
+        - sample.gauge(addresses, "pyroscope_compactor_tenants_processing_failed")
+        - sample.gauge(addresses, "pyroscope_compactor_tenants_skipped")
+    )
+    if pending <= 0:
+        return 0
+    last_progress = max(
+        sample.gauge(
+            addresses, "pyroscope_compactor_last_successful_run_timestamp_seconds"
+        ),
+        sample.gauge(addresses, "process_start_time_seconds"),
+    )
+    if sample.timestamp - last_progress < COMPACTION_INTERVAL_SECONDS:
+        return 0
+    return pending
+
+
+def recommend(
+    sample: ClusterSample,
+    addresses_by_role: dict[str, set[str]],
+    current_units: dict[str, int],
+) -> dict[str, int]:
+    """Recommend a number of units for each (non-meta) Pyroscope role.
+
+    Roles for which no load signal is available keep their current unit count.
+    """
+    recommended = {
+        role.value: max(1, current_units.get(role, 0))
+        for role in PyroscopeRole.all_nonmeta()
+    }
+
+    distributors = addresses_by_role.get(PyroscopeRole.distributor, set())
+    if ingest_rate := sample.rate(
+        distributors, "pyroscope_distributor_received_decompressed_bytes_sum"
+    ):
+        recommended[PyroscopeRole.distributor] = _ceil_units(
+            ingest_rate, DISTRIBUTOR_TARGET_BYTES_PER_SECOND
+        )
+
+    ingesters = addresses_by_role.get(PyroscopeRole.ingester, set())
+    heap = sample.gauge(ingesters, "go_memstats_heap_inuse_bytes")
+    series = sample.gauge(ingesters, "pyroscope_tsdb_head_series")
+    if heap or series:
+        ingester_units = max(
+            _ceil_units(heap, INGESTER_TARGET_HEAP_BYTES),
+            _ceil_units(series, INGESTER_TARGET_SERIES),
+        )
+        # past a single unit, the ring wants every series on REPLICATION_FACTOR ingesters
+        if ingester_units > 1:
+            ingester_units = max(ingester_units, REPLICATION_FACTOR)
+        recommended[PyroscopeRole.ingester] = ingester_units
+
+    # read requests hit the query-frontend, but it's the queriers that do the heavy lifting
+    frontends = addresses_by_role.get(PyroscopeRole.query_frontend, set())
+    p99 = sample.quantile(
+        frontends, "pyroscope_request_duration_seconds", 0.99, READ_ROUTES_REGEX
+    )
+    if p99 is not None:
+        queriers = recommended[PyroscopeRole.querier]
+        recommended[PyroscopeRole.querier] = _ceil_units(
+            queriers * p99, QUERIER_TARGET_P99_SECONDS
+        )
+
+    compactors = addresses_by_role.get(PyroscopeRole.compactor, set())
+    backlog = sum(_compactor_backlog(sample, address) for address in compactors)
+    if backlog > 0:
+        recommended[PyroscopeRole.compactor] += min(
+            math.ceil(backlog / COMPACTOR_TARGET_PENDING_TENANTS),
+            COMPACTOR_MAX_EXTRA_UNITS,
+        )
+
+    return recommended
@@ -14,3 +14,38 @@ def base_state(request, s3, nginx_container, nginx_prometheus_exporter_container
 def test_smoke(context, base_state):
     # verify the charm runs at all with and without leadership
     context.run(context.on.start(), base_state)
+
+
+@pytest.mark.parametrize(
+    "limits, expected",
+    (
+        ({}, {"cpu": "60m", "memory": "100Mi"}),
+        (
+            {"cpu_limit": "55m", "memory_limit": "64Mi"},
+            {"cpu": "55m", "memory": "64Mi"},
+        ),
+    ),
+)
+def test_nginx_resources_requests(
+    context,
+    s3,
+    all_worker,
+    nginx_container,
+    nginx_prometheus_exporter_container,
+    limits,
+    expected,
+):
+    # GIVEN a coordinator with a single worker unit, and possibly resources limits
+    state = State(
+        config=limits,
+        relations=[s3, all_worker],
+        containers=[nginx_container, nginx_prometheus_exporter_container],
+    )
+
+    # WHEN the nginx resources requests are computed
+    with context(context.on.update_status(), state) as mgr:
+        charm = mgr.charm
+        requests = charm._nginx_resources_requests(charm.coordinator)
+
+    # THEN they grow with the workers, and never exceed the limits
+    assert requests == expected
@@ -0,0 +1,223 @@
+import json
+from unittest.mock import PropertyMock, patch
+
+import ops
+from ops.testing import Relation, State
+
+from charm_profiling import StackSampler
+from profile_export import build_export_request
+
+
+def test_build_export_request():
+    # GIVEN samples of two stacks sharing their root frame, one of them sampled twice
+    reconcile = (("reconcile", "charm.py", 10), ("main", "ops/main.py", 1))
+    publish = (("publish", "profiling.py", 20), ("main", "ops/main.py", 1))
+    samples = [
+        (reconcile, 30_000_000, {}),
+        (publish, 10_000_000, {"tenant": "a"}),
+        (reconcile, 10_000_000, {"tenant": "a"}),
+    ]
+
+    # WHEN they are converted to an export request
+    request = build_export_request(
+        samples,
+        service_name="pyroscope-coordinator-k8s",
+        sample_type="wall",
+        period=10_000_000,
+        start_time_ns=0,
+        duration_ns=40_000_000,
+        attributes={"juju_hook": "update-status"},
+    )
+
+    # THEN each sample is kept, with its value
+    profile = request.resource_profiles[0].scope_profiles[0].profiles[0]
+    assert [sample.values[0] for sample in profile.samples] == [
+        30_000_000,
+        10_000_000,
+        10_000_000,
+    ]
+    # AND the frames, stacks and labels are deduplicated
+    dictionary = request.dictionary
+    assert len(dictionary.location_table) == 4
+    assert len(dictionary.stack_table) == 3
+    assert len(dictionary.attribute_table) == 2
+    assert [list(sample.attribute_indices) for sample in profile.samples] == [
+        [],
+        [1],
+        [1],
+    ]
+    leaves = [
+        dictionary.string_table[
+            dictionary.function_table[
+                dictionary.location_table[
+                    dictionary.stack_table[sample.stack_index].location_indices[0]
+                ]
+                .lines[0]
+                .function_index
+            ].name_strindex
+        ]
+        for sample in profile.samples
+    ]
+    assert leaves == ["reconcile", "publish", "reconcile"]
+    # AND the profile is attributed to the service
+    attributes = {
+        kv.key: kv.value.string_value
+        for kv in request.resource_profiles[0].resource.attributes
+    }
+    assert attributes == {
+        "service.name": "pyroscope-coordinator-k8s",
+        "juju_hook": "update-status",
+    }
+
+
+def test_charm_profile_exported(
+    context, s3, all_worker, nginx_container, nginx_prometheus_exporter_container
+):
+    # GIVEN a charm-profiling relation
+    charm_profiling = Relation(
+        "charm-profiling",
+        remote_app_data={
+            "otlp_grpc_endpoint_url": json.dumps("pyroscope.example:4317"),
+            "insecure": json.dumps(True),
+        },
+    )
+
+    # WHEN any event is processed
+    with (
+        patch.object(StackSampler, "start"),
+        patch.object(
+            StackSampler, "stop", return_value={(("reconcile", "charm.py", 1),): 1}
+        ),
+        patch("charm_profiling.export") as export_mock,
+    ):
+        context.run(
+            context.on.update_status(),
+            State(
+                relations=[s3, all_worker, charm_profiling],
+                containers=[nginx_container, nginx_prometheus_exporter_container],
+                unit_status=ops.ActiveStatus(),
+            ),
+        )
+
+    # THEN the profile of the hook is sent to the profiling endpoint
+    export_mock.assert_called_once()
+    request, endpoint, insecure, _ = export_mock.call_args.args
+    assert (endpoint, insecure) == ("pyroscope.example:4317", True)
+    attributes = {
+        kv.key: kv.value.string_value
+        for kv in request.resource_profiles[0].resource.attributes
+    }
+    assert attributes["juju_hook"] == "update-status"
+
+
+def test_charm_not_profiled_without_endpoint(
+    context, s3, all_worker, nginx_container, nginx_prometheus_exporter_container
+):
+    # GIVEN no charm-profiling relation
+    # WHEN any event is processed
+    with (
+        patch.object(StackSampler, "start") as start_mock,
+        patch("charm_profiling.export") as export_mock,
+    ):
+        context.run(
+            context.on.update_status(),
+            State(
+                relations=[s3, all_worker],
+                containers=[nginx_container, nginx_prometheus_exporter_container],
+                unit_status=ops.ActiveStatus(),
+            ),
+        )
+
+    # THEN the charm isn't sampled, and no profile is sent
+    start_mock.assert_not_called()
+    export_mock.assert_not_called()
+
+
+def test_charm_profile_export_failure(
+    context, s3, all_worker, nginx_container, nginx_prometheus_exporter_container
+):
+    # GIVEN a charm-profiling relation to an endpoint the profiles can't be sent to
+    charm_profiling = Relation(
+        "charm-profiling",
+        remote_app_data={
+            "otlp_grpc_endpoint_url": json.dumps("pyroscope.example:4317"),
+            "insecure": json.dumps(True),
+        },
+    )
+
+    # WHEN any event is processed
+    with (
+        patch.object(StackSampler, "start"),
+        patch.object(
+            StackSampler, "stop", return_value={(("reconcile", "charm.py", 1),): 1}
+        ),
+        patch("charm_profiling.export", side_effect=ValueError("no such host")),
+    ):
+        state_out = context.run(
+            context.on.update_status(),
+            State(
+                relations=[s3, all_worker, charm_profiling],
+                containers=[nginx_container, nginx_prometheus_exporter_container],
+                unit_status=ops.ActiveStatus(),
+            ),
+        )
+
+    # THEN the hook doesn't fail
+    assert isinstance(state_out.unit_status, ops.ActiveStatus)
+
+
+def test_charm_profiling_endpoints_failure(
+    context, s3, all_worker, nginx_container, nginx_prometheus_exporter_container
+):
+    # GIVEN profiling endpoints that can't be read
+    # WHEN any event is processed
+    with (
+        patch(
+            "charm.PyroscopeCoordinatorCharm.charm_profiling_endpoints",
+            new_callable=PropertyMock,
+            side_effect=ValueError("invalid databag"),
+        ),
+        patch.object(StackSampler, "start") as start_mock,
+    ):
+        state_out = context.run(
+            context.on.update_status(),
+            State(
+                relations=[s3, all_worker],
+                containers=[nginx_container, nginx_prometheus_exporter_container],
+                unit_status=ops.ActiveStatus(),
+            ),
+        )
+
+    # THEN the charm isn't sampled, and the hook doesn't fail
+    start_mock.assert_not_called()
+    assert isinstance(state_out.unit_status, ops.ActiveStatus)
+
+
+def test_charm_not_profiled_without_profiling_extra(
+    context, s3, all_worker, nginx_container, nginx_prometheus_exporter_container
+):
+    # GIVEN a charm-profiling relation, and a charm packed without the `profiling` extra
+    charm_profiling = Relation(
+        "charm-profiling",
+        remote_app_data={
+            "otlp_grpc_endpoint_url": json.dumps("pyroscope.example:4317"),
+            "insecure": json.dumps(True),
+        },
+    )
+
+    # WHEN any event is processed
+    with (
+        patch("charm_profiling.grpc", None),
+        patch.object(StackSampler, "start") as start_mock,
+    ):
+        context.run(
+            context.on.update_status(),
+            State(
+                relations=[s3, all_worker, charm_profiling],
+                containers=[nginx_container, nginx_prometheus_exporter_container],
+                unit_status=ops.ActiveStatus(),
+            ),
+        )
+
+    # THEN the charm isn't sampled
+    start_mock.assert_not_called()
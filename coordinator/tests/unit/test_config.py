@@ -3,11 +3,10 @@ from dataclasses import replace
 
 import pytest
 import yaml
-from ops.testing import State
+from ops.testing import Relation, State
 
 from charm import PyroscopeCoordinatorCharm
 
-
 DEFAULT_RETENTION_PERIOD_CONFIG = "1d"
 DISABLED_RETENTION_PERIOD_CONFIG = 0
 VALID_RETENTION_PERIOD_CONFIG = "7d"
@@ -148,6 +147,49 @@ def test_ingester_config(
         assert actual_config_dict["ingester"] == expected_config
 
 
+@pytest.mark.parametrize(
+    "queriers_no, expected_outstanding, expected_worker_concurrency",
+    # 4 queries per querier, with a single query-scheduler and query-frontend
+    ((1, 100, 8), (40, 328, 164)),
+)
+def test_query_path_config(
+    queriers_no,
+    expected_outstanding,
+    expected_worker_concurrency,
+    context,
+    state_with_s3_and_workers,
+    all_worker,
+    s3,
+):
+    # GIVEN an all-roles worker, and a querier worker relation that has n units
+    querier_workers = Relation(
+        "pyroscope-cluster",
+        remote_app_data={"role": '"querier"'},
+        remote_units_data={
+            worker_idx: get_worker_unit_data(worker_idx)
+            for worker_idx in range(queriers_no)
+        },
+    )
+    state = replace(
+        state_with_s3_and_workers, relations={all_worker, querier_workers, s3}
+    )
+    # WHEN an event is fired
+    with context(context.on.relation_changed(querier_workers), state) as mgr:
+        charm: PyroscopeCoordinatorCharm = mgr.charm
+        actual_config_dict = yaml.safe_load(charm.pyroscope.config(charm.coordinator))
+
+    # THEN the query-scheduler queues twice as many queries as all the queriers can run
+    # (the all-roles worker runs a querier, too)
+    assert actual_config_dict["query_scheduler"] == {
+        "max_outstanding_requests_per_tenant": expected_outstanding
+    }
+    # AND the query-frontend opens enough connections to the query-scheduler to keep up
+    assert actual_config_dict["frontend"] == {
+        "scheduler_worker_concurrency": expected_worker_concurrency
+    }
+    assert actual_config_dict["frontend_worker"] == {"max_concurrent": 4}
+
+
 @pytest.mark.parametrize("workers_no", (1, 3))
 def test_store_gateway_config(
     workers_no, context, state_with_s3_and_workers, all_worker, s3
@@ -201,6 +243,90 @@ def test_s3_storage_config(context, state_with_s3_and_workers):
         assert actual_config_dict["storage"] == expected_config
 
 
+def test_s3_storage_tuning_config(
+    context,
+    all_worker,
+    s3_config,
+    nginx_container,
+    nginx_prometheus_exporter_container,
+    peers,
+):
+    # GIVEN an s3 relation addressing the bucket by path, and s3 client tuning options
+    s3 = Relation(
+        "s3",
+        remote_app_data={**s3_config, "s3-uri-style": "path"},
+        local_unit_data={"bucket": "pyroscope"},
+    )
+    state = State(
+        leader=True,
+        config={
+            "s3_max_idle_connections_per_host": 200,
+            "s3_idle_connection_timeout": "5m",
+            "s3_sse_type": "SSE-KMS",
+            "s3_sse_kms_key_id": "key-id",
+        },
+        relations=[all_worker, s3, peers],
+        containers=[nginx_container, nginx_prometheus_exporter_container],
+    )
+    # WHEN an event is fired
+    with context(context.on.config_changed(), state) as mgr:
+        charm: PyroscopeCoordinatorCharm = mgr.charm
+        s3_storage_config = yaml.safe_load(charm.pyroscope.config(charm.coordinator))[
+            "storage"
+        ]["s3"]
+
+    # THEN the s3 client is configured with the relation's uri style and the tuning options
+    assert s3_storage_config["bucket_lookup_type"] == "path"
+    assert s3_storage_config["sse"] == {"type": "SSE-KMS", "kms_key_id": "key-id"}
+    # AND only the configured http options override the upstream defaults
+    assert s3_storage_config["http"] == {
+        "idle_conn_timeout": "5m",
+        "max_idle_connections_per_host": 200,
+    }
+
+
+@pytest.mark.parametrize(
+    "charm_config, s3_path, expected_prefix",
+    (
+        ({}, None, None),
+        ({}, "/pyroscope/cluster-a/", "pyroscopeclustera"),
+        ({"storage_prefix": "clusterb"}, "/pyroscope/cluster-a/", "clusterb"),
+    ),
+)
+def test_storage_prefix_config(
+    context,
+    all_worker,
+    s3_config,
+    nginx_container,
+    nginx_prometheus_exporter_container,
+    peers,
+    charm_config,
+    s3_path,
+    expected_prefix,
+):
+    # GIVEN an s3 relation, possibly with a path, and possibly a storage prefix option
+    s3 = Relation(
+        "s3",
+        remote_app_data={**s3_config, **({"path": s3_path} if s3_path else {})},
+        local_unit_data={"bucket": "pyroscope"},
+    )
+    state = State(
+        leader=True,
+        config=charm_config,
+        relations=[all_worker, s3, peers],
+        containers=[nginx_container, nginx_prometheus_exporter_container],
+    )
+    # WHEN an event is fired
+    with context(context.on.config_changed(), state) as mgr:
+        charm: PyroscopeCoordinatorCharm = mgr.charm
+        storage_config = yaml.safe_load(charm.pyroscope.config(charm.coordinator))[
+            "storage"
+        ]
+
+    # THEN the objects are stored under the configured prefix, or the relation's path
+    assert storage_config.get("prefix") == expected_prefix
+
+
 def test_base_url_config_without_ingress(context, state_with_s3_and_workers):
     with context(context.on.config_changed(), state_with_s3_and_workers) as mgr:
         charm: PyroscopeCoordinatorCharm = mgr.charm
@@ -347,3 +473,247 @@ def test_retention_period_config(
             actual_compactor_config["cleanup_interval"]
             == expected_pyroscope_config["cleanup_interval"]
         )
+
+
+@pytest.mark.parametrize("self_profiling", (True, False, None))
+def test_self_profiling_config(
+    context,
+    all_worker,
+    s3,
+    nginx_container,
+    nginx_prometheus_exporter_container,
+    peers,
+    self_profiling,
+):
+    # GIVEN a coordinator with self-profiling enabled, disabled or left unset
+    state = State(
+        leader=True,
+        config={} if self_profiling is None else {"self_profiling": self_profiling},
+        relations=[all_worker, s3, peers],
+        containers=[nginx_container, nginx_prometheus_exporter_container],
+    )
+    with context(context.on.config_changed(), state) as mgr:
+        charm: PyroscopeCoordinatorCharm = mgr.charm
+        # WHEN the pyroscope config is generated
+        actual_config_dict = yaml.safe_load(charm.pyroscope.config(charm.coordinator))
+
+    # THEN the workers push their own profiles as configured, or as Pyroscope defaults to if unset
+    if self_profiling is None:
+        assert "self_profiling" not in actual_config_dict
+    else:
+        assert actual_config_dict["self_profiling"] == {
+            "disable_push": not self_profiling
+        }
+    relabeling_rules = actual_config_dict["limits"].get("ingestion_relabeling_rules")
+    if not self_profiling:
+        assert relabeling_rules is None
+        return
+
+    # AND the profiles are labelled with the juju topology and roles of the worker they come from
+    labels = {rule["target_label"]: rule["replacement"] for rule in relabeling_rules}
+    assert labels["juju_application"] == "worker"
+    assert labels["juju_unit"] == "worker/$1"
+    assert labels["roles"] == "all"
+    assert {rule["regex"] for rule in relabeling_rules} >= {"pyroscope;worker-([0-9]+)"}
+
+
+@pytest.mark.parametrize(
+    "charm_config, expected_sampler",
+    (
+        ({}, None),
+        (
+            {
+                "workload_tracing_sampler_type": "probabilistic",
+                "workload_tracing_sampler_param": 0.1,
+            },
+            {"type": "probabilistic", "param": 0.1},
+        ),
+        (
+            {
+                "workload_tracing_sampler_type": "remote",
+                "workload_tracing_sampler_param": 0.5,
+                "workload_tracing_sampling_server_url": "http://jaeger:5778/sampling",
+            },
+            {
+                "type": "remote",
+                "param": 0.5,
+                "server_url": "http://jaeger:5778/sampling",
+            },
+        ),
+    ),
+)
+def test_workload_tracing_sampler(
+    context,
+    all_worker,
+    s3,
+    nginx_container,
+    nginx_prometheus_exporter_container,
+    peers,
+    charm_config,
+    expected_sampler,
+):
+    # GIVEN a coordinator with a workload tracing sampler configured
+    state = State(
+        leader=True,
+        config=charm_config,
+        relations=[all_worker, s3, peers],
+        containers=[nginx_container, nginx_prometheus_exporter_container],
+    )
+
+    # WHEN the coordinator publishes the cluster data
+    state_out = context.run(context.on.config_changed(), state)
+
+    # THEN the sampler is handed to the worker charms in the worker config, unless it's the default
+    cluster_data = state_out.get_relation(all_worker.id).local_app_data
+    worker_config = yaml.safe_load(json.loads(cluster_data["worker_config"]))
+    assert (
+        worker_config.get("charm", {}).get("workload_tracing_sampler")
+        == expected_sampler
+    )
+
+
+@pytest.mark.parametrize(
+    "charm_config",
+    (
+        {"workload_tracing_sampler_type": "adaptive"},
+        {
+            "workload_tracing_sampler_type": "const",
+            "workload_tracing_sampler_param": 0.5,
+        },
+        {
+            "workload_tracing_sampler_type": "probabilistic",
+            "workload_tracing_sampler_param": 2.0,
+        },
+        {"workload_tracing_sampler_type": "remote"},
+    ),
+)
+def test_invalid_workload_tracing_sampler(
+    context,
+    all_worker,
+    s3,
+    nginx_container,
+    nginx_prometheus_exporter_container,
+    peers,
+    charm_config,
+):
+    # GIVEN a coordinator with an invalid workload tracing sampler
+    state = State(
+        leader=True,
+        config=charm_config,
+        relations=[all_worker, s3, peers],
+        containers=[nginx_container, nginx_prometheus_exporter_container],
+    )
+
+    # WHEN any event is processed
+    state_out = context.run(context.on.config_changed(), state)
+
+    # THEN the charm is blocked
+    assert state_out.unit_status.name == "blocked"
+    assert "workload_tracing_sampl" in state_out.unit_status.message
+
+
+def test_retention_overrides(
+    context,
+    all_worker,
+    s3,
+    nginx_container,
+    nginx_prometheus_exporter_container,
+    peers,
+):
+    # GIVEN a coordinator with a longer retention for prod, and a shorter one for ci
+    state = State(
+        leader=True,
+        config={"retention_period": "7d", "retention_overrides": "prod=30d, ci=1d"},
+        relations=[all_worker, s3, peers],
+        containers=[nginx_container, nginx_prometheus_exporter_container],
+    )
+
+    # WHEN the coordinator publishes the cluster data
+    state_out = context.run(context.on.config_changed(), state)
+
+    # THEN the workers load the overrides from their runtime config
+    cluster_data = state_out.get_relation(all_worker.id).local_app_data
+    worker_config = yaml.safe_load(json.loads(cluster_data["worker_config"]))
+    assert worker_config["runtime_config"] == {
+        "file": "/etc/worker/runtime-config.yaml"
+    }
+    assert worker_config["limits"]["compactor_blocks_retention_period"] == "7d"
+    # AND the overrides are handed to the worker charms in the worker config
+    assert worker_config["charm"]["runtime_config"] == {
+        "overrides": {
+            "prod": {"compactor_blocks_retention_period": "30d"},
+            "ci": {"compactor_blocks_retention_period": "1d"},
+        }
+    }
+
+
+def test_no_retention_overrides(
+    context,
+    all_worker,
+    s3,
+    nginx_container,
+    nginx_prometheus_exporter_container,
+    peers,
+):
+    # GIVEN a coordinator without retention overrides
+    state = State(
+        leader=True,
+        relations=[all_worker, s3, peers],
+        containers=[nginx_container, nginx_prometheus_exporter_container],
+    )
+
+    # WHEN the coordinator publishes the cluster data
+    state_out = context.run(context.on.config_changed(), state)
+
+    # THEN the workers run without a runtime config, as the ones that don't know about it do
+    cluster_data = state_out.get_relation(all_worker.id).local_app_data
+    worker_config = yaml.safe_load(json.loads(cluster_data["worker_config"]))
+    assert "runtime_config" not in worker_config
+    assert "charm" not in worker_config
+
+
+@pytest.mark.parametrize("overrides", ("prod", "prod=30", "=1d", "prod=1d,ci=forever"))
+def test_invalid_retention_overrides(
+    context,
+    all_worker,
+    s3,
+    nginx_container,
+    nginx_prometheus_exporter_container,
+    peers,
+    overrides,
+):
+    # GIVEN a coordinator with invalid retention overrides
+    state = State(
+        leader=True,
+        config={"retention_overrides": overrides},
+        relations=[all_worker, s3, peers],
+        containers=[nginx_container, nginx_prometheus_exporter_container],
+    )
+
+    # WHEN any event is processed
+    state_out = context.run(context.on.config_changed(), state)
+
+    # THEN the charm is blocked
+    assert state_out.unit_status.name == "blocked"
+    assert "retention_overrides" in state_out.unit_status.message
+
+
+@pytest.mark.parametrize("downsampling", (False, True))
+def test_compactor_downsampling_config(
+    downsampling, context, state_with_s3_and_workers
+):
+    # GIVEN a coordinator with compactor downsampling enabled, or not
+    state = replace(
+        state_with_s3_and_workers, config={"compactor_downsampling": downsampling}
+    )
+    # WHEN an event is fired
+    with context(context.on.config_changed(), state) as mgr:
+        charm: PyroscopeCoordinatorCharm = mgr.charm
+        limits = yaml.safe_load(charm.pyroscope.config(charm.coordinator))["limits"]
+
+    # THEN the compactor downsamples the blocks only if enabled
+    if downsampling:
+        assert limits["compactor_downsampler_enabled"] is True
+    else:
+        # AND the upstream default is left alone otherwise
+        assert "compactor_downsampler_enabled" not in limits
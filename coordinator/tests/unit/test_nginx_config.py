@@ -1,6 +1,8 @@
 import pytest
+from charmlibs.nginx_k8s import NginxConfig
 
 import nginx_config
+from pyroscope_config import PyroscopeRole
 
 
 @pytest.mark.parametrize(
@@ -29,3 +31,129 @@ def test_servers_config():
 
     # THEN the locations are mapped to the right port
     assert server_ports_to_locations[nginx_config.http_server_port]
+
+
+def test_upstream_map_config():
+    # GIVEN the http and grpc locations
+
+    # WHEN the upstream map is generated
+    value_mappings = nginx_config.upstream_map_config().value_mappings
+
+    # THEN exact locations are matched as strings, prefix locations as regexes
+    assert value_mappings["/ingest"] == ["distributor"]
+    assert value_mappings["~^/pyroscope"] == ["query-frontend"]
+    assert value_mappings[r"~^/opentelemetry\.proto\.collector"] == ["distributor"]
+    assert value_mappings["default"] == ["-"]
+
+
+def test_access_log_format():
+    # GIVEN a pyroscope nginx config
+    config = nginx_config.PyroscopeNginxConfig(
+        server_name="pyroscope",
+        upstream_configs=nginx_config.upstreams(4040),
+        server_ports_to_locations=nginx_config.server_ports_to_locations(),
+    )
+
+    # WHEN the config is rendered
+    rendered = config.get_config({"distributor": {"10.0.0.1"}}, listen_tls=False)
+
+    # THEN the access logs are written in the structured format, with the upstream timings
+    assert "access_log /dev/stderr timed;" in rendered
+    assert "log_format timed escape=json" in rendered
+    assert "$upstream_response_time" in rendered
+    assert "map $uri $pyroscope_upstream" in rendered
+
+
+def test_location_directives():
+    # GIVEN the lib's nginx config, and the pyroscope one with its custom locations
+    kwargs = {
+        "server_name": "pyroscope",
+        "upstream_configs": nginx_config.upstreams(4040),
+    }
+    upstreams = {role: {"10.0.0.1"} for role in PyroscopeRole}
+    base = NginxConfig(
+        server_ports_to_locations={
+            nginx_config.http_server_port: nginx_config.http_locations,
+            nginx_config.grpc_server_port: nginx_config.grpc_locations,
+        },
+        **kwargs,
+    ).get_config(upstreams, listen_tls=False)
+
+    # WHEN it's rendered
+    rendered = nginx_config.PyroscopeNginxConfig(
+        server_ports_to_locations=nginx_config.server_ports_to_locations(
+            client_max_body_size="64m"
+        ),
+        **kwargs,
+    ).get_config(upstreams, listen_tls=False)
+
+    # THEN the access logs format is defined once, at the top of the http block
+    assert rendered.count("log_format timed ") == 1
+    assert rendered.index("log_format timed ") < rendered.index("server {")
+    # AND every location logs in it, and takes the custom buffers
+    locations = len(nginx_config.http_locations) + len(nginx_config.grpc_locations)
+    for directive in (
+        "access_log /dev/stderr timed;",
+        "client_max_body_size 64m;",
+        "proxy_buffers 8 16k;",
+    ):
+        assert rendered.count(directive) == locations
+    # AND the rest of the lib's config is left untouched
+    assert rendered.count("access_log ") == base.count("access_log ") + locations
+
+
+@pytest.mark.parametrize(
+    "cpu_limit, memory_limit, worker_processes, expected",
+    [
+        # no limits: nginx's defaults
+        (None, None, None, (5, 4096)),
+        # one worker process per core
+        (0.5, None, None, (1, 4096)),
+        (2, None, None, (2, 4096)),
+        (16, None, None, (5, 4096)),
+        # the connections of all the worker processes fit in the memory limit
+        (2, 2**28, None, (2, 2048)),
+        (None, 2**20, None, (5, 512)),
+        # the user-set worker processes share the memory limit
+        (None, 2**28, 4, (4, 1024)),
+    ],
+)
+def test_worker_tuning(cpu_limit, memory_limit, worker_processes, expected):
+    # GIVEN some resources limits
+    # WHEN the nginx workers are tuned on them
+    # THEN they fit in the limits
+    assert (
+        nginx_config.worker_tuning(cpu_limit, memory_limit, worker_processes)
+        == expected
+    )
+
+
+def test_worker_tuning_rendered():
+    # GIVEN a pyroscope nginx config tuned for a 2 cores, 256Mi container
+    worker_processes, worker_connections = nginx_config.worker_tuning(2, 2**28)
+    config = nginx_config.PyroscopeNginxConfig(
+        server_name="pyroscope",
+        upstream_configs=nginx_config.upstreams(4040),
+        server_ports_to_locations=nginx_config.server_ports_to_locations(),
+        worker_processes=worker_processes,
+        worker_connections=worker_connections,
+    )
+
+    # WHEN the config is rendered
+    rendered = config.get_config({"distributor": {"10.0.0.1"}}, listen_tls=False)
+
+    # THEN the workers, their open files limit and the buffers are configured
+    assert "worker_processes 2;" in rendered
+    assert "worker_connections 2048;" in rendered
+    assert "worker_rlimit_nofile 4096;" in rendered
+    assert "client_max_body_size 32m;" in rendered
+    assert "proxy_buffer_size 16k;" in rendered
+    assert "proxy_buffers 8 16k;" in rendered
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [("512", 512), ("16k", 16 * 2**10), ("32m", 32 * 2**20), ("1G", 2**30)],
+)
+def test_size_bytes(size, expected):
+    assert nginx_config.size_bytes(size) == expected
@@ -1,17 +1,30 @@
 import dataclasses
 import json
+from unittest.mock import patch
 
 import ops
 import pytest
 
 import nginx_config
-from ops.testing import State, Context
+from ops.testing import Context, Relation, State
 from conftest import tls_patch
 from charms.pyroscope_coordinator_k8s.v0.profiling import (
+    IngestHints,
+    ProfilingEndpointProvider,
     ProfilingEndpointRequirer,
     Endpoint,
 )
 
+# with the default nginx_client_max_body_size of 32m, above the distributors' 4MiB profile size limit
+EXPECTED_INGEST_HINTS = json.dumps(
+    {
+        "max_message_bytes": 4 * 2**20,
+        "batch_interval": "15s",
+        "max_concurrent_streams": 128,
+        "compression": "gzip",
+    }
+)
+
 
 @pytest.mark.parametrize(
     "tls",
@@ -42,12 +55,21 @@ def test_provide_profiling(
         )
     profiling_out = state_out.get_relation(profiling.id)
 
-    assert profiling_out.local_app_data == {
+    scheme = "https" if tls else "http"
+    expected = {
         "insecure": json.dumps(not tls),
         "otlp_grpc_endpoint_url": json.dumps(
             f"foo.com:{nginx_config.grpc_server_port}"
         ),
+        "ingest_endpoint_url": json.dumps(
+            f"{scheme}://foo.com:{nginx_config.http_server_port}/ingest"
+        ),
+        "ingest_hints": EXPECTED_INGEST_HINTS,
     }
+    if not tls:
+        # the distributors can be reached directly, bypassing nginx
+        expected["distributor_endpoint_urls"] = json.dumps(["localhost:4040"])
+    assert profiling_out.local_app_data == expected
 
 
 @pytest.mark.parametrize(
@@ -74,32 +96,75 @@ def test_provide_profiling_ingress(
     ingress_tls,
     expected_insecure,
 ):
+    state = State(
+        relations=[
+            peers,
+            s3,
+            ingress_with_tls if ingress_tls else ingress,
+            all_worker,
+            profiling,
+        ],
+        containers=[nginx_container, nginx_prometheus_exporter_container],
+        unit_status=ops.ActiveStatus(),
+        leader=True,
+    )
     with tls_patch(internal_tls):
-        state_out = context.run(
-            context.on.update_status(),
-            State(
-                relations=[
-                    peers,
-                    s3,
-                    ingress_with_tls if ingress_tls else ingress,
-                    all_worker,
-                    profiling,
-                ],
-                containers=[nginx_container, nginx_prometheus_exporter_container],
-                unit_status=ops.ActiveStatus(),
-                leader=True,
-            ),
-        )
+        state_out = context.run(context.on.update_status(), state)
     profiling_out = state_out.get_relation(profiling.id)
 
+    scheme = "https" if ingress_tls else "http"
+    prefix = f"{state.model.name}-pyroscope-coordinator-k8s"
+    # the distributors can't be reached from outside the cluster: only nginx is advertised
     assert profiling_out.local_app_data == {
         "insecure": json.dumps(expected_insecure),
         "otlp_grpc_endpoint_url": json.dumps(
             f"{external_host}:{nginx_config.grpc_server_port}"
         ),
+        "ingest_endpoint_url": json.dumps(
+            f"{scheme}://{external_host}/{prefix}/ingest"
+        ),
+        "ingest_hints": EXPECTED_INGEST_HINTS,
     }
 
 
+@pytest.mark.parametrize(
+    "max_body_size, expected_max_message_bytes",
+    (
+        ("1k", 2**10),
+        # the distributors reject profiles larger than 4MiB
+        ("32m", 4 * 2**20),
+        # "0" disables the limit of nginx, not the distributors'
+        ("0", 4 * 2**20),
+    ),
+)
+def test_ingest_hints_max_message_bytes(
+    context,
+    s3,
+    all_worker,
+    nginx_container,
+    nginx_prometheus_exporter_container,
+    profiling,
+    peers,
+    max_body_size,
+    expected_max_message_bytes,
+):
+    with tls_patch(False):
+        state_out = context.run(
+            context.on.update_status(),
+            State(
+                relations=[peers, s3, all_worker, profiling],
+                containers=[nginx_container, nginx_prometheus_exporter_container],
+                config={"nginx_client_max_body_size": max_body_size},
+                unit_status=ops.ActiveStatus(),
+                leader=True,
+            ),
+        )
+    ingest_hints = json.loads(
+        state_out.get_relation(profiling.id).local_app_data["ingest_hints"]
+    )
+    assert ingest_hints.get("max_message_bytes") == expected_max_message_bytes
+
+
 @pytest.mark.parametrize(
     "databag, expected",
     (
@@ -112,6 +177,24 @@ def test_provide_profiling_ingress(
             {"otlp_grpc_endpoint_url": '"foo.com:1234"', "insecure": '"false"'},
             [Endpoint(otlp_grpc="foo.com:1234", insecure=False)],
         ),
+        (
+            {
+                "otlp_grpc_endpoint_url": '"foo.com:1234"',
+                "ingest_endpoint_url": '"http://foo.com:8080/ingest"',
+                "distributor_endpoint_urls": '["10.0.0.1:4040", "10.0.0.2:4040"]',
+                "ingest_hints": '{"max_message_bytes": 1048576, "compression": "gzip"}',
+            },
+            [
+                Endpoint(
+                    otlp_grpc="foo.com:1234",
+                    ingest="http://foo.com:8080/ingest",
+                    distributors=["10.0.0.1:4040", "10.0.0.2:4040"],
+                    ingest_hints=IngestHints(
+                        max_message_bytes=2**20, compression="gzip"
+                    ),
+                )
+            ],
+        ),
     ),
 )
 def test_require_profiling(profiling, databag, expected):
@@ -128,3 +211,150 @@ def test_require_profiling(profiling, databag, expected):
     ) as mgr:
         ep = ProfilingEndpointRequirer(mgr.charm.model.relations["profiling"])
         assert ep.get_endpoints() == expected
+
+
+def test_publish_endpoint_only_updates_changed_relations():
+    # GIVEN a relation already holding the endpoint, and one that doesn't yet
+    published = {
+        "otlp_grpc_endpoint_url": json.dumps("foo.com:1234"),
+        "insecure": json.dumps(True),
+    }
+    up_to_date = Relation("profiling", local_app_data=published)
+    outdated = Relation(
+        "profiling", local_app_data={**published, "insecure": json.dumps(False)}
+    )
+    ctx = Context(
+        ops.CharmBase,
+        meta={
+            "name": "pyroscope",
+            "provides": {"profiling": {"interface": "profiling"}},
+        },
+    )
+    with ctx(
+        state=State(relations={up_to_date, outdated}, leader=True),
+        event=ctx.on.update_status(),
+    ) as mgr:
+        provider = ProfilingEndpointProvider(
+            mgr.charm.model.relations["profiling"], mgr.charm.app
+        )
+        # WHEN the endpoint is published
+        changed = provider.publish_endpoint("foo.com:1234", insecure=True)
+        # THEN only the outdated relation is reported as changed
+        assert [relation.id for relation in changed] == [outdated.id]
+        # AND publishing it again changes nothing
+        assert provider.publish_endpoint("foo.com:1234", insecure=True) == []
+        state_out = mgr.run()
+
+    # AND both relations hold the endpoint
+    assert state_out.get_relation(outdated.id).local_app_data == published
+    assert state_out.get_relation(up_to_date.id).local_app_data == published
+
+
+@pytest.fixture
+def requirer_context():
+    return Context(
+        ops.CharmBase,
+        meta={
+            "name": "mateusz",
+            "requires": {"profiling": {"interface": "profiling"}},
+        },
+    )
+
+
+@pytest.fixture
+def remote_and_local_profiling():
+    remote = Relation(
+        "profiling",
+        remote_app_data={
+            "otlp_grpc_endpoint_url": '"pyroscope.example.com:443"',
+            "ingest_endpoint_url": '"https://pyroscope.example.com/ingest"',
+        },
+    )
+    local = Relation(
+        "profiling",
+        remote_app_data={
+            "otlp_grpc_endpoint_url": '"pyroscope.test.svc.cluster.local:4317"',
+            "insecure": "true",
+        },
+    )
+    return remote, local
+
+
+@pytest.mark.parametrize(
+    "protocols, expected_host, expected_protocol",
+    (
+        # the endpoints in the same cluster are preferred
+        (("otlp_grpc",), "pyroscope.test.svc.cluster.local:4317", "otlp_grpc"),
+        # over the protocols the workload prefers, if they're supported
+        (("ingest", "otlp_grpc"), "https://pyroscope.example.com/ingest", "ingest"),
+    ),
+)
+def test_get_preferred_endpoint(
+    requirer_context,
+    remote_and_local_profiling,
+    protocols,
+    expected_host,
+    expected_protocol,
+):
+    # GIVEN a local and a remote profiling backend
+    with requirer_context(
+        state=State(relations=set(remote_and_local_profiling)),
+        event=requirer_context.on.update_status(),
+    ) as mgr:
+        ep = ProfilingEndpointRequirer(mgr.charm.model.relations["profiling"])
+        # WHEN the endpoint to use is chosen
+        endpoint, protocol = ep.get_preferred_endpoint(protocols)
+
+    # THEN it's the closest one supporting the most preferred protocol
+    assert (endpoint.address(protocol), protocol) == (expected_host, expected_protocol)
+
+
+def test_get_endpoints_by_health(requirer_context, remote_and_local_profiling):
+    # GIVEN a reachable remote profiling backend, and an unreachable local one
+    latencies = {
+        "pyroscope.example.com:443": 0.1,
+        "pyroscope.test.svc.cluster.local:4317": None,
+    }
+    with requirer_context(
+        state=State(relations=set(remote_and_local_profiling)),
+        event=requirer_context.on.update_status(),
+    ) as mgr:
+        ep = ProfilingEndpointRequirer(mgr.charm.model.relations["profiling"])
+        # WHEN the endpoints are ordered by health
+        with patch(
+            "charms.pyroscope_coordinator_k8s.v0.profiling.probe",
+            side_effect=lambda endpoint, *_: latencies[endpoint.otlp_grpc],
+        ):
+            endpoints = ep.get_endpoints_by_health()
+
+    # THEN the reachable one comes first
+    assert [endpoint.otlp_grpc for endpoint in endpoints] == [
+        "pyroscope.example.com:443",
+        "pyroscope.test.svc.cluster.local:4317",
+    ]
+
+
+def test_get_otel_collector_config(requirer_context, remote_and_local_profiling):
+    # GIVEN a remote (TLS) and a local (plain text) profiling backend
+    with requirer_context(
+        state=State(relations=set(remote_and_local_profiling)),
+        event=requirer_context.on.update_status(),
+    ) as mgr:
+        ep = ProfilingEndpointRequirer(mgr.charm.model.relations["profiling"])
+        # WHEN the collector config is generated
+        config = ep.get_otel_collector_config(ca_file="/etc/ssl/ca.crt")
+
+    # THEN the profiles are batched
+    assert config["processors"]["batch/profiling"]["send_batch_size"] == 1000
+    # AND queued and retried for each endpoint
+    exporters = config["exporters"]
+    assert len(exporters) == 2
+    assert all(e["sending_queue"]["enabled"] for e in exporters.values())
+    assert all(e["retry_on_failure"]["enabled"] for e in exporters.values())
+    # AND the CA certificate is only used for the TLS endpoint
+    assert sorted(
+        (e["endpoint"], e["tls"].get("ca_file")) for e in exporters.values()
+    ) == [
+        ("pyroscope.example.com:443", "/etc/ssl/ca.crt"),
+        ("pyroscope.test.svc.cluster.local:4317", None),
+    ]
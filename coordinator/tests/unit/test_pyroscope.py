@@ -1,7 +1,22 @@
+from pathlib import Path
 from unittest.mock import MagicMock
+
 import pytest
+import yaml
+
+from pyroscope import (
+    MIN_MAX_OUTSTANDING_REQUESTS_PER_TENANT,
+    QUERY_SCHEDULER_QUEUE_DEPTH,
+    Pyroscope,
+)
 
-from pyroscope import Pyroscope
+WORKER_ALERTS = (
+    Path(__file__).parents[2]
+    / "src"
+    / "prometheus_alert_rules"
+    / "workers"
+    / "alerts.yaml"
+)
 
 
 @pytest.mark.parametrize("url", ("/", None, "foo.com"))
@@ -22,4 +37,28 @@ def test_pyroscope(url, coordinator_charm_config):
         "insecure": True,
         "tls_ca_path": "s3-tls_ca_path",
     }
+    mm.s3_requirer.get_s3_connection_info.return_value = {"path": "s3-path"}
     assert cfg.config(mm)
+
+
+@pytest.mark.parametrize(
+    "alert",
+    (
+        "PyroscopeQuerySchedulerQueueNearLimit",
+        "PyroscopeQuerySchedulerQueuePredictedToReachLimit",
+    ),
+)
+def test_query_queue_alerts_match_the_configured_limit(alert):
+    # GIVEN the alerts on the query-scheduler queue
+    groups = yaml.safe_load(WORKER_ALERTS.read_text())["groups"]
+    rule = next(
+        rule
+        for group in groups
+        for rule in group["rules"]
+        if rule.get("alert") == alert
+    )
+    # THEN they derive the queue limit the same way the coordinator configures it
+    assert (
+        f"clamp_min({QUERY_SCHEDULER_QUEUE_DEPTH} * pyroscope_query_scheduler_connected_querier_clients, "
+        f"{MIN_MAX_OUTSTANDING_REQUESTS_PER_TENANT})"
+    ) in rule["expr"]
@@ -0,0 +1,91 @@
+import json
+from unittest.mock import patch
+
+import pytest
+from ops.testing import State
+
+import retention
+import scaling
+
+
+@pytest.mark.parametrize(
+    "period, expected",
+    (("0", None), ("500ms", 0.5), ("90s", 90), ("12h", 12 * 3600), ("1w", 7 * 86400)),
+)
+def test_timespec_seconds(period, expected):
+    assert retention.timespec_seconds(period) == expected
+
+
+def test_list_retention():
+    # GIVEN overrides for prod and archive, and tenants ingesting profiles
+    overrides = {"prod": "30d", "archive": "0"}
+    ingest_rates = {"prod": 100.0, "ci": 1000.0, "archive": 10.0}
+
+    # WHEN the retention of the tenants is listed
+    tenants = retention.list_retention("1d", overrides, ingest_rates)
+
+    # THEN every tenant is listed, with the storage its profiles take
+    assert [tenant.to_dict() for tenant in tenants] == [
+        # never deleted: no estimate
+        {
+            "tenant": "archive",
+            "retention_period": "0",
+            "overridden": True,
+            "ingest_bytes_per_second": 10.0,
+        },
+        {
+            "tenant": "ci",
+            "retention_period": "1d",
+            "overridden": False,
+            "ingest_bytes_per_second": 1000.0,
+            "estimated_bytes": 1000 * 86400,
+        },
+        {
+            "tenant": "prod",
+            "retention_period": "30d",
+            "overridden": True,
+            "ingest_bytes_per_second": 100.0,
+            "estimated_bytes": 100 * 30 * 86400,
+        },
+    ]
+
+
+def test_list_retention_action(
+    context,
+    s3,
+    all_worker,
+    nginx_container,
+    nginx_prometheus_exporter_container,
+):
+    # GIVEN a distributor that has ingested 10 bytes/s for the anonymous tenant
+    metric = "pyroscope_distributor_received_decompressed_bytes_sum"
+    sample = scaling.ClusterSample(
+        interval=10,
+        before={
+            "localhost": scaling.parse_metrics(f'{metric}{{tenant="anonymous"}} 0')
+        },
+        after={
+            "localhost": scaling.parse_metrics(f'{metric}{{tenant="anonymous"}} 100')
+        },
+    )
+    state = State(
+        leader=True,
+        config={"retention_overrides": "prod=30d"},
+        relations=[s3, all_worker],
+        containers=[nginx_container, nginx_prometheus_exporter_container],
+    )
+
+    # WHEN we run the list-retention action
+    with patch("scaling.sample_cluster", return_value=sample):
+        context.run(
+            context.on.action("list-retention", params={"sample-interval": 10}), state
+        )
+
+    # THEN the retention of each tenant is listed, with an estimate of its storage
+    results = context.action_results
+    assert results["retention-period"] == "1d"
+    assert results["estimated-bytes"] == 10 * 86400
+    assert [
+        (tenant["tenant"], tenant["retention_period"])
+        for tenant in json.loads(results["tenants"])
+    ] == [("anonymous", "1d"), ("prod", "30d")]
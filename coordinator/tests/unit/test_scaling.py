@@ -0,0 +1,179 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest.mock import patch
+
+import pytest
+from ops.testing import ActionFailed, State
+
+import scaling
+from pyroscope_config import PyroscopeRole
+
+GiB = 1024 * 1024 * 1024
+MiB = 1024 * 1024
+
+
+class FakeMetrics:
+    """Fake worker metrics; counters and histograms grow at a fixed pace at each scrape."""
+
+    def __init__(
+        self,
+        ingest_bytes_per_scrape: float = 0,
+        heap_bytes: float = 0,
+        series: float = 0,
+        slow_render_requests_per_scrape: int = 0,
+        pending_tenants: int = 0,
+        last_compaction_run_age: float = 0,
+    ):
+        self.ingest_bytes_per_scrape = ingest_bytes_per_scrape
+        self.heap_bytes = heap_bytes
+        self.series = series
+        self.slow_render_requests_per_scrape = slow_render_requests_per_scrape
+        self.pending_tenants = pending_tenants
+        self.last_compaction_run_age = last_compaction_run_age
+        self.scrapes = 0
+
+    def render(self) -> str:
+        self.scrapes += 1
+        ingested = self.ingest_bytes_per_scrape * self.scrapes
+        slow = self.slow_render_requests_per_scrape * self.scrapes
+        route = 'route="pyroscope_render"'
+        return "\n".join(
+            (
+                "# HELP pyroscope_distributor_received_decompressed_bytes whatever",
+                "# TYPE pyroscope_distributor_received_decompressed_bytes histogram",
+                f'pyroscope_distributor_received_decompressed_bytes_sum{{tenant="anonymous"}} {ingested}',
+                f"go_memstats_heap_inuse_bytes {self.heap_bytes}",
+                f"pyroscope_tsdb_head_series {self.series}",
+                # all slow requests land in the (2.5, 5] bucket
+                f'pyroscope_request_duration_seconds_bucket{{{route},le="1"}} 0',
+                f'pyroscope_request_duration_seconds_bucket{{{route},le="2.5"}} 0',
+                f'pyroscope_request_duration_seconds_bucket{{{route},le="5"}} {slow}',
+                f'pyroscope_request_duration_seconds_bucket{{{route},le="+Inf"}} {slow}',
+                f"pyroscope_compactor_tenants_discovered {self.pending_tenants}",
+                "pyroscope_compactor_tenants_processing_succeeded 0",
+                "pyroscope_compactor_last_successful_run_timestamp_seconds "
+                f"{time.time() - self.last_compaction_run_age}",
+                "",
+            )
+        )
+
+
+@pytest.fixture
+def fake_metrics():
+    metrics = FakeMetrics()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("localhost", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    with patch("pyroscope.Pyroscope.http_server_port", server.server_port):
+        yield metrics
+    server.shutdown()
+    server.server_close()
+
+
+def test_parse_metrics():
+    # GIVEN a metrics exposition with comments, labels and special values
+    text = '# HELP foo a counter\nfoo{a="b",c="d, e"} 3\nbar 1e3\nbaz_bucket{le="+Inf"} +Inf'
+    # WHEN we parse it
+    metrics = scaling.parse_metrics(text)
+    # THEN samples are grouped by name and labels are parsed
+    assert metrics["foo"][0].label("c") == "d, e"
+    assert metrics["bar"][0].value == 1000
+    assert metrics["baz_bucket"][0].label("le") == "+Inf"
+
+
+@pytest.mark.parametrize(
+    "fake, role, expected",
+    (
+        # 40MiB/s against an 8MiB/s per-unit target
+        (FakeMetrics(ingest_bytes_per_scrape=40 * MiB), PyroscopeRole.distributor, 5),
+        (FakeMetrics(heap_bytes=5 * GiB), PyroscopeRole.ingester, 3),
+        (FakeMetrics(series=1_200_000), PyroscopeRole.ingester, 3),
+        # p99 somewhere in the (2.5, 5] bucket against a 1s target
+        (FakeMetrics(slow_render_requests_per_scrape=10), PyroscopeRole.querier, 5),
+        # the ring replicates the series to 3 ingesters as soon as there's more than one
+        (FakeMetrics(heap_bytes=3 * GiB), PyroscopeRole.ingester, 3),
+        (FakeMetrics(series=2_400_000), PyroscopeRole.ingester, 5),
+        # a compaction run in progress: the pending tenants aren't a backlog (yet)
+        (FakeMetrics(pending_tenants=2), PyroscopeRole.compactor, 1),
+        # a compaction run that's been going on for longer than the compaction interval
+        (
+            FakeMetrics(pending_tenants=1, last_compaction_run_age=2 * 60 * 60),
+            PyroscopeRole.compactor,
+            2,
+        ),
+        # ...scales the compactors out, but only so far
+        (
+            FakeMetrics(pending_tenants=10, last_compaction_run_age=2 * 60 * 60),
+            PyroscopeRole.compactor,
+            3,
+        ),
+    ),
+)
+def test_recommend(fake, role, expected):
+    # GIVEN a monolithic worker with a single unit, scraped twice one second apart
+    sample = scaling.ClusterSample(
+        interval=1,
+        before={"worker": scaling.parse_metrics(fake.render())},
+        after={"worker": scaling.parse_metrics(fake.render())},
+    )
+    addresses = {role: {"worker"} for role in PyroscopeRole.all_nonmeta()}
+    current = {role: 1 for role in PyroscopeRole.all_nonmeta()}
+
+    # WHEN we ask for a recommendation
+    recommended = scaling.recommend(sample, addresses, current)
+
+    # THEN the role under load is scaled up and the others are left alone
+    assert recommended[role] == expected
+    assert all(n == 1 for r, n in recommended.items() if r != role)
+
+
+def test_recommend_scale_action(
+    context,
+    fake_metrics,
+    s3,
+    all_worker,
+    nginx_container,
+    nginx_prometheus_exporter_container,
+):
+    # GIVEN a monolithic worker whose ingesters are running out of memory
+    fake_metrics.heap_bytes = 3 * GiB
+    state = State(
+        leader=True,
+        relations=[s3, all_worker],
+        containers=[nginx_container, nginx_prometheus_exporter_container],
+    )
+
+    # WHEN we run the recommend-scale action
+    with patch("time.sleep"):
+        context.run(
+            context.on.action("recommend-scale", params={"sample-interval": 1}), state
+        )
+
+    # THEN the worker metrics were scraped and enough ingesters to replicate to are recommended
+    assert fake_metrics.scrapes == 2
+    assert context.action_results["current"][PyroscopeRole.ingester] == 1
+    assert context.action_results["recommended"][PyroscopeRole.ingester] == 3
+    assert context.action_results["recommended"][PyroscopeRole.distributor] == 1
+
+
+def test_recommend_scale_action_no_workers(context, s3, nginx_container):
+    # GIVEN no workers
+    state = State(leader=True, relations=[s3], containers=[nginx_container])
+
+    # WHEN we run the recommend-scale action
+    # THEN the action fails
+    with pytest.raises(ActionFailed):
+        context.run(context.on.action("recommend-scale"), state)
@@ -1,78 +1,146 @@
 #!/usr/bin/env python3
-"""Utility script to generate a mock CPU profile and export it using OTLP gRPC to a profiling backend (i.e. Pyroscope/Otel Collector)."""
+"""Utility script to generate mock CPU profiles and export them using OTLP gRPC to a profiling backend (i.e. Pyroscope/Otel Collector).
 
+Without arguments, a single profile is sent to the endpoint configured by the PROFILEGEN_* environment variables.
+With `--duration`, it turns into a load generator that sustains a target rate of exports
+from a pool of concurrent exporters, and reports throughput, export latency and error rates.
+
+The profiles are built with the coordinator charm's `profile_export` module, which is loaded
+from the coordinator's source tree next to this script.
+
+Examples:
+    # send one profile
+    PROFILEGEN_ENDPOINT=10.1.2.3:4317 python scripts/profilegen.py
+
+    # 50 profiles per second for one minute, from 10 services, with a couple of labels
+    python scripts/profilegen.py --endpoint 10.1.2.3:4317 \
+        --duration 60 --rate 50 --services 10 --label region=3
+"""
+
+import argparse
+import dataclasses
+import functools
+import itertools
+import json
+import logging
 import os
-from typing import Optional
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
 import grpc
-from opentelemetry.proto.profiles.v1development import profiles_pb2
 from opentelemetry.proto.collector.profiles.v1development import (
     profiles_service_pb2,
     profiles_service_pb2_grpc,
 )
-from opentelemetry.proto.common.v1 import common_pb2
-from pathlib import Path
-import logging
+
+# the charm and this script build their profiles with the same module, which lives in the charm
+sys.path.append(str(Path(__file__).resolve().parents[1] / "coordinator" / "src"))
+from profile_export import Stack, build_export_request
 
 logger = logging.getLogger(__name__)
 
 
-def _build_profile() -> profiles_pb2.Profile:
-    sample_type = profiles_pb2.ValueType(
-        # The indices will internally reference whatever is in the profile's dictionary's `string_table`
-        type_strindex=1,  # "cpu"
-        unit_strindex=2,  # "nanoseconds"
-    )
+@dataclasses.dataclass(frozen=True)
+class ProfileSpec:
+    """Shape of the generated profiles."""
 
-    sample = profiles_pb2.Sample(
-        locations_start_index=0,
-        locations_length=1,
-        value=[100],  # 1 nanosecond
-        attribute_indices=[0],
-    )
+    stack_depth: int = 1
+    """Number of frames in each stack."""
+    functions: int = 1
+    """Number of distinct functions the stacks are built from."""
+    stacks: int = 1
+    """Number of distinct stacks per service."""
+    samples: int = 1
+    """Number of samples in each profile."""
+    labels: Dict[str, int] = dataclasses.field(default_factory=dict)
+    """Label names, mapped to the number of distinct values each of them can take."""
 
-    return profiles_pb2.Profile(
-        sample_type=[sample_type],
-        sample=[sample],
-        location_indices=[0],
-        period_type=sample_type,
-        period=1,
-        default_sample_type_index=0,
-    )
 
+class ProfileBuilder:
+    """Build export requests for a service.
 
-def _build_profile_dictionary(service_name: str) -> profiles_pb2.ProfilesDictionary:
-    # index 0 must be "" (empty string) by convention
-    string_table = [
-        "",
-        "cpu",
-        "nanoseconds",
-        "profilegen-main-function",
-    ]
+    The stacks are generated once, from the service name: builders of the same service, e.g. in
+    different exporters, share the same `spec.stacks` stacks. Each request gets a fresh set of
+    samples, drawn with `seed`, and timestamp.
+    """
 
-    function = profiles_pb2.Function(
-        name_strindex=3,  # "profilegen-main-function"
-    )
+    def __init__(
+        self,
+        service_name: str,
+        spec: Optional[ProfileSpec] = None,
+        seed: Optional[int] = None,
+    ):
+        self._service_name = service_name
+        self._spec = spec or ProfileSpec()
+        self._rng = random.Random(seed)
+        self._stacks = self._build_stacks()
 
-    location = profiles_pb2.Location(
-        mapping_index=0,
-        line=[
-            profiles_pb2.Line(
-                function_index=0,  # refers to first function in Profile.function
+    def _build_stacks(self) -> List[Stack]:
+        spec = self._spec
+        rng = random.Random(self._service_name)
+        frames = [
+            (f"profilegen-function-{i}", f"profilegen/module_{i}.py", i + 1)
+            for i in range(spec.functions)
+        ]
+        stacks = []
+        for _ in range(spec.stacks):
+            # all stacks share the same root frame, as real programs do
+            stack = [frames[0]] + [
+                rng.choice(frames) for _ in range(spec.stack_depth - 1)
+            ]
+            # frames are ordered leaf first
+            stacks.append(tuple(stack[::-1]))
+        return stacks
+
+    def build_request(self) -> profiles_service_pb2.ExportProfilesServiceRequest:
+        """Build an export request carrying a single profile."""
+        samples = [
+            (
+                self._rng.choice(self._stacks),
+                self._rng.randint(1, 100) * 10_000_000,  # multiples of 10ms
+                {
+                    key: f"{key}-{self._rng.randrange(cardinality)}"
+                    for key, cardinality in self._spec.labels.items()
+                },
             )
-        ],
-    )
+            for _ in range(self._spec.samples)
+        ]
+        return build_export_request(
+            samples,
+            service_name=self._service_name,
+            sample_type="cpu",
+            period=10_000_000,
+            start_time_ns=time.time_ns(),
+            duration_ns=1_000_000_000,
+        )
 
-    attribute = common_pb2.KeyValue(
-        key="service.name",
-        value=common_pb2.AnyValue(string_value=service_name),
-    )
 
-    return profiles_pb2.ProfilesDictionary(
-        string_table=string_table,
-        location_table=[location],
-        function_table=[function],
-        mapping_table=[profiles_pb2.Mapping()],
-        attribute_table=[attribute],
+@functools.lru_cache(maxsize=None)
+def get_channel(
+    endpoint: str,
+    insecure: bool,
+    ca_path: Optional[str] = None,
+    server_name: Optional[str] = None,
+) -> grpc.Channel:
+    """Return a gRPC channel to the endpoint; channels are cached and reused across calls."""
+    if insecure:
+        return grpc.insecure_channel(endpoint)
+
+    ca_cert_bytes = (
+        Path(ca_path).read_bytes() if ca_path and Path(ca_path).exists() else None
+    )
+    # override the server name as the certificate might not match the actual hostname we're connecting to
+    options = (("grpc.ssl_target_name_override", server_name),) if server_name else ()
+    return grpc.secure_channel(
+        endpoint,
+        grpc.ssl_channel_credentials(root_certificates=ca_cert_bytes),
+        options=options,
     )
 
 
@@ -82,43 +150,240 @@ def emit_profile(
     insecure: bool,
     ca_path: Optional[str] = None,
     server_name: Optional[str] = None,
+    spec: Optional[ProfileSpec] = None,
+    timeout: Optional[float] = None,
 ):
-    profile = _build_profile()
-    profile_dictionary = _build_profile_dictionary(service_name)
+    """Send a single profile to the endpoint."""
+    request = ProfileBuilder(service_name, spec).build_request()
+    channel = get_channel(endpoint, insecure, ca_path, server_name)
+    stub = profiles_service_pb2_grpc.ProfilesServiceStub(channel)
+    stub.Export(request, timeout=timeout)
 
-    request = profiles_service_pb2.ExportProfilesServiceRequest(
-        resource_profiles=[
-            profiles_pb2.ResourceProfiles(
-                scope_profiles=[profiles_pb2.ScopeProfiles(profiles=[profile])],
-            )
-        ],
-        dictionary=profile_dictionary,
+
+@dataclasses.dataclass
+class LoadStats:
+    """Outcome of a load generation run."""
+
+    duration: float = 0.0
+    latencies: List[float] = dataclasses.field(default_factory=list)
+    errors: Dict[str, int] = dataclasses.field(default_factory=dict)
+
+    @property
+    def sent(self) -> int:
+        return len(self.latencies) + sum(self.errors.values())
+
+    @property
+    def throughput(self) -> float:
+        """Successful exports per second."""
+        return len(self.latencies) / self.duration if self.duration else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.errors.values()) / self.sent if self.sent else 0.0
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Export latency percentile, in seconds."""
+        if not self.latencies:
+            return None
+        if len(self.latencies) == 1:
+            return self.latencies[0]
+        return statistics.quantiles(self.latencies, n=100, method="inclusive")[
+            int(p) - 1
+        ]
+
+    def as_dict(self) -> dict:
+        return {
+            "duration_seconds": round(self.duration, 3),
+            "sent": self.sent,
+            "succeeded": len(self.latencies),
+            "errors": dict(self.errors),
+            "error_rate": round(self.error_rate, 4),
+            "throughput_per_second": round(self.throughput, 2),
+            "latency_seconds": {
+                "p50": self.percentile(50),
+                "p99": self.percentile(99),
+                "max": max(self.latencies, default=None),
+            },
+        }
+
+
+def generate_load(
+    endpoint: str,
+    insecure: bool,
+    duration: float,
+    rate: float = 0,
+    concurrency: int = 4,
+    services: Sequence[str] = ("profilegen-service",),
+    spec: Optional[ProfileSpec] = None,
+    ca_path: Optional[str] = None,
+    server_name: Optional[str] = None,
+    timeout: float = 10,
+) -> LoadStats:
+    """Export profiles for `duration` seconds from `concurrency` exporters sharing one channel.
+
+    Exports are scheduled at a fixed pace to sustain `rate` profiles per second overall;
+    with a rate of 0, exporters send as fast as the backend lets them.
+    Services take turns, so each of them gets an equal share of the load.
+    """
+    stub = profiles_service_pb2_grpc.ProfilesServiceStub(
+        get_channel(endpoint, insecure, ca_path, server_name)
     )
+    stats = LoadStats()
+    lock = threading.Lock()
+    schedule = itertools.count()
 
-    if insecure:
-        channel = grpc.insecure_channel(endpoint)
-    else:
-        ca_cert_bytes = (
-            Path(ca_path).read_bytes() if ca_path and Path(ca_path).exists() else None
-        )
-        # override the server name as the certificate might not match the actual hostname we're connecting to
-        options = (
-            (("grpc.ssl_target_name_override", server_name),) if server_name else ()
+    start = time.monotonic()
+    deadline = start + duration
+
+    def exporter(worker_id: int):
+        # builders aren't thread safe: each exporter gets its own, with the same stacks
+        builders = [
+            ProfileBuilder(service, spec, seed=worker_id) for service in services
+        ]
+        while True:
+            with lock:
+                n = next(schedule)
+            scheduled = start + n / rate if rate else time.monotonic()
+            if scheduled >= deadline:
+                return
+            if (delay := scheduled - time.monotonic()) > 0:
+                time.sleep(delay)
+
+            request = builders[n % len(builders)].build_request()
+            t0 = time.monotonic()
+            try:
+                stub.Export(request, timeout=timeout)
+            except grpc.RpcError as e:
+                code = e.code().name if isinstance(e, grpc.Call) else "UNKNOWN"
+                with lock:
+                    stats.errors[code] = stats.errors.get(code, 0) + 1
+                continue
+            latency = time.monotonic() - t0
+            with lock:
+                stats.latencies.append(latency)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(exporter, i) for i in range(concurrency)]:
+            future.result()
+    stats.duration = time.monotonic() - start
+    return stats
+
+
+def _parse_label(value: str) -> tuple:
+    key, _, cardinality = value.partition("=")
+    if not key or not cardinality.isdigit() or int(cardinality) < 1:
+        raise argparse.ArgumentTypeError(
+            f"expected NAME=CARDINALITY (e.g. region=3), got {value!r}"
         )
-        channel = grpc.secure_channel(
-            endpoint,
-            grpc.ssl_channel_credentials(root_certificates=ca_cert_bytes),
-            options=options,
+    return key, int(cardinality)
+
+
+def positive_int(value: str) -> int:
+    """Parse a strictly positive integer, for argparse."""
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got {value!r}")
+    return int(value)
+
+
+def _parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--endpoint", default=os.getenv("PROFILEGEN_ENDPOINT", "127.0.0.1:4317")
+    )
+    parser.add_argument(
+        "--service", default=os.getenv("PROFILEGEN_SERVICE", "profilegen-service")
+    )
+    parser.add_argument(
+        "--insecure",
+        action=argparse.BooleanOptionalAction,
+        default=os.getenv("PROFILEGEN_INSECURE", "True").lower() in ("true", "1"),
+    )
+    parser.add_argument("--ca-path", default=os.getenv("PROFILEGEN_CA_PATH", None))
+    parser.add_argument(
+        "--server-name", default=os.getenv("PROFILEGEN_SERVER_NAME", None)
+    )
+
+    shape = parser.add_argument_group("profile shape")
+    shape.add_argument("--stack-depth", type=positive_int, default=1)
+    shape.add_argument("--functions", type=positive_int, default=1)
+    shape.add_argument("--stacks", type=positive_int, default=1)
+    shape.add_argument("--samples", type=positive_int, default=1)
+    shape.add_argument(
+        "--label",
+        dest="labels",
+        type=_parse_label,
+        action="append",
+        default=[],
+        metavar="NAME=CARDINALITY",
+        help="Attach a label to each sample, taking one of CARDINALITY values.",
+    )
+
+    load = parser.add_argument_group("load generation")
+    load.add_argument(
+        "--duration",
+        type=float,
+        default=0,
+        help="Generate load for this many seconds instead of sending a single profile.",
+    )
+    load.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="Target profiles per second, overall. 0 means as fast as possible.",
+    )
+    load.add_argument("--concurrency", type=positive_int, default=4)
+    load.add_argument(
+        "--services",
+        type=positive_int,
+        default=1,
+        help="Spread the load over this many services, named after --service.",
+    )
+    load.add_argument("--timeout", type=float, default=10)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    args = _parse_args(argv)
+    spec = ProfileSpec(
+        stack_depth=args.stack_depth,
+        functions=args.functions,
+        stacks=args.stacks,
+        samples=args.samples,
+        labels=dict(args.labels),
+    )
+
+    if not args.duration:
+        emit_profile(
+            endpoint=args.endpoint,
+            service_name=args.service,
+            insecure=args.insecure,
+            ca_path=args.ca_path,
+            server_name=args.server_name,
+            spec=spec,
         )
-    stub = profiles_service_pb2_grpc.ProfilesServiceStub(channel)
-    stub.Export(request)
+        return
+
+    services = (
+        [args.service]
+        if args.services == 1
+        else [f"{args.service}-{i}" for i in range(args.services)]
+    )
+    stats = generate_load(
+        endpoint=args.endpoint,
+        insecure=args.insecure,
+        duration=args.duration,
+        rate=args.rate,
+        concurrency=args.concurrency,
+        services=services,
+        spec=spec,
+        ca_path=args.ca_path,
+        server_name=args.server_name,
+        timeout=args.timeout,
+    )
+    print(json.dumps(stats.as_dict(), indent=2))
 
 
 if __name__ == "__main__":
-    emit_profile(
-        endpoint=os.getenv("PROFILEGEN_ENDPOINT", "127.0.0.1:4317"),
-        service_name=os.getenv("PROFILEGEN_SERVICE", "profilegen-service"),
-        insecure=os.getenv("PROFILEGEN_INSECURE", "True").lower() in ("true", "1"),
-        ca_path=os.getenv("PROFILEGEN_CA_PATH", None),
-        server_name=os.getenv("PROFILEGEN_SERVER_NAME", None),
-    )
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Pooled, in-process clients for the Pyroscope HTTP query API and the OTLP gRPC ingestion endpoint.
+
+Shared by the integration tests and the benchmark scripts, so that they don't have to shell out to `curl`
+or spawn a new interpreter for every profile they send.
+"""
+
+import functools
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from profilegen import ProfileSpec, emit_profile, get_channel
+
+__all__ = [
+    "ProfileSpec",
+    "PyroscopeClient",
+    "emit_profile",
+    "get_channel",
+    "get_client",
+]
+
+PROFILE_TYPE = "process_cpu:cpu:nanoseconds:cpu:nanoseconds"
+
+Timestamp = Union[int, str]
+"""Unix timestamp in milliseconds, or a relative time understood by Pyroscope (e.g. `now-1h`)."""
+
+
+class _ServerNameAdapter(HTTPAdapter):
+    """Connection-pooling adapter that validates TLS certificates against a fixed server name.
+
+    Equivalent to `curl --resolve`: we connect to whatever host the URL points to,
+    but send (SNI) and verify the server name the certificate was issued for.
+    """
+
+    def __init__(self, server_name: str, **kwargs):
+        self._server_name = server_name
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["server_hostname"] = self._server_name
+        kwargs["assert_hostname"] = self._server_name
+        super().init_poolmanager(*args, **kwargs)
+
+
+class PyroscopeClient:
+    """Client for the Pyroscope HTTP API, backed by a persistent session with connection pooling."""
+
+    def __init__(
+        self,
+        url: str,
+        ca_path: Optional[str] = None,
+        server_name: Optional[str] = None,
+        pool_size: int = 10,
+        timeout: float = 30,
+    ):
+        self.url = url.rstrip("/")
+        self._timeout = timeout
+        self._session = requests.Session()
+
+        adapter = (
+            _ServerNameAdapter(server_name, pool_maxsize=pool_size)
+            if server_name
+            else HTTPAdapter(pool_maxsize=pool_size)
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        if server_name:
+            port = urlparse(self.url).port
+            self._session.headers["Host"] = (
+                f"{server_name}:{port}" if port else server_name
+            )
+        # passed on each request: a session-level `verify` would be overridden by REQUESTS_CA_BUNDLE
+        self._verify = str(ca_path) if ca_path else True
+
+    def close(self):
+        self._session.close()
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        response = self._session.get(
+            f"{self.url}{path}", timeout=self._timeout, verify=self._verify, **kwargs
+        )
+        response.raise_for_status()
+        return response
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        response = self._session.post(
+            f"{self.url}{path}", timeout=self._timeout, verify=self._verify, **kwargs
+        )
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def selector(service_name: str) -> str:
+        return f'{{service_name="{service_name}"}}'
+
+    def render(
+        self,
+        service_name: str,
+        start: Timestamp = "now-1h",
+        end: Timestamp = "now",
+        profile_type: str = PROFILE_TYPE,
+    ) -> Dict[str, Any]:
+        """Query the flamegraph of a service."""
+        return self.get(
+            "/pyroscope/render",
+            params={
+                "query": f"{profile_type}{self.selector(service_name)}",
+                "from": start,
+                "until": end,
+            },
+        ).json()
+
+    def render_diff(
+        self,
+        service_name: str,
+        left: Tuple[Timestamp, Timestamp],
+        right: Tuple[Timestamp, Timestamp],
+        profile_type: str = PROFILE_TYPE,
+    ) -> Dict[str, Any]:
+        """Query the diff flamegraph of a service between two time ranges."""
+        query = f"{profile_type}{self.selector(service_name)}"
+        return self.get(
+            "/pyroscope/render-diff",
+            params={
+                "leftQuery": query,
+                "leftFrom": left[0],
+                "leftUntil": left[1],
+                "rightQuery": query,
+                "rightFrom": right[0],
+                "rightUntil": right[1],
+            },
+        ).json()
+
+    def label_names(self, service_name: str, start: int, end: int) -> List[str]:
+        """Label names of a service's profiles; start and end are unix timestamps in milliseconds."""
+        return (
+            self.post(
+                "/querier.v1.QuerierService/LabelNames",
+                json={
+                    "matchers": [self.selector(service_name)],
+                    "start": start,
+                    "end": end,
+                },
+            )
+            .json()
+            .get("names", [])
+        )
+
+    def series(
+        self,
+        service_name: str,
+        start: int,
+        end: int,
+        label_names: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Series of a service's profiles; start and end are unix timestamps in milliseconds."""
+        return (
+            self.post(
+                "/querier.v1.QuerierService/Series",
+                json={
+                    "matchers": [self.selector(service_name)],
+                    "labelNames": label_names or [],
+                    "start": start,
+                    "end": end,
+                },
+            )
+            .json()
+            .get("labelsSet", [])
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def get_client(
+    url: str, ca_path: Optional[str] = None, server_name: Optional[str] = None
+) -> PyroscopeClient:
+    """Return a client for the URL; clients are cached, so that their connection pools are reused."""
+    return PyroscopeClient(url, ca_path=ca_path, server_name=server_name)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""Benchmark the Pyroscope query path: flamegraph, diff, label names and series queries.
+
+Optionally seeds the backend with profiles (see profilegen.py) first, then runs each query
+over several time ranges and concurrency levels and writes a JSON report with latency percentiles.
+Pass the report of a previous run as `--baseline` to print how the p99 latencies moved.
+
+Seeding sends profiles in real time, so it only covers the last `--seed-duration` seconds: the
+longer ranges (e.g. 24h) mostly span time without profiles, and measure the query overhead rather
+than the cost of reading data. Benchmark the long ranges against a cluster that has been ingesting
+for at least that long.
+
+Example:
+    python querybench.py --url http://10.1.2.3:8080 --seed-endpoint 10.1.2.3:42424 --output rc.json
+    python querybench.py --url http://10.1.2.3:8080 --output rc.json --baseline stable.json
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import requests
+
+from profilegen import ProfileSpec, generate_load, positive_int
+from pyroscope_client import PyroscopeClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RANGES = ("5m", "1h", "6h", "24h")
+DEFAULT_CONCURRENCY = (1, 4, 16)
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+Query = Callable[[PyroscopeClient, str, int, int], Any]
+"""Query a service's profiles between two unix timestamps in milliseconds."""
+
+
+def _render_diff(client: PyroscopeClient, service: str, start: int, end: int):
+    # compare the first half of the range to the second
+    middle = (start + end) // 2
+    return client.render_diff(service, left=(start, middle), right=(middle, end))
+
+
+def _series(client: PyroscopeClient, service: str, start: int, end: int):
+    return client.series(
+        service, start, end, label_names=["service_name", "__profile_type__"]
+    )
+
+
+QUERIES: Dict[str, Query] = {
+    "flamegraph": PyroscopeClient.render,
+    "diff": _render_diff,
+    "label-names": PyroscopeClient.label_names,
+    "series": _series,
+}
+
+
+def parse_duration(value: str) -> int:
+    """Parse a duration like `5m` or `24h` into seconds."""
+    try:
+        return int(value[:-1]) * _UNITS[value[-1]]
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError(
+            f"expected a duration like 30s, 5m, 1h or 7d, got {value!r}"
+        )
+
+
+def percentiles(latencies: Sequence[float]) -> Dict[str, Optional[float]]:
+    """Latency percentiles of a run, in seconds."""
+    if not latencies:
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+    if len(latencies) == 1:
+        quantiles = [latencies[0]] * 99
+    else:
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50": quantiles[49],
+        "p90": quantiles[89],
+        "p99": quantiles[98],
+        "max": max(latencies),
+    }
+
+
+def run_query(
+    client: PyroscopeClient,
+    query: Query,
+    service: str,
+    time_range: int,
+    concurrency: int,
+    requests_per_level: int,
+) -> dict:
+    """Run `requests_per_level` identical queries, `concurrency` at a time."""
+    end = int(time.time() * 1000)
+    start = end - time_range * 1000
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def once(_):
+        t0 = time.monotonic()
+        try:
+            query(client, service, start, end)
+        except requests.RequestException as e:
+            status = getattr(e.response, "status_code", None)
+            key = str(status) if status else type(e).__name__
+            with lock:
+                errors[key] = errors.get(key, 0) + 1
+            return
+        latency = time.monotonic() - t0
+        with lock:
+            latencies.append(latency)
+
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(once, range(requests_per_level)))
+    elapsed = time.monotonic() - t0
+
+    return {
+        "requests": requests_per_level,
+        "errors": errors,
+        "throughput_per_second": round(len(latencies) / elapsed, 2),
+        "latency_seconds": percentiles(latencies),
+    }
+
+
+def compare(report: dict, baseline: dict):
+    """Print the p99 latency change of each benchmark with respect to a baseline report."""
+    old = {
+        (r["query"], r["range"], r["concurrency"]): r["latency_seconds"]["p99"]
+        for r in baseline["results"]
+    }
+    for result in report["results"]:
+        key = (result["query"], result["range"], result["concurrency"])
+        new_p99, old_p99 = result["latency_seconds"]["p99"], old.get(key)
+        if new_p99 is None or not old_p99:
+            continue
+        change = (new_p99 - old_p99) / old_p99 * 100
+        print(
+            f"{key[0]:>12} {key[1]:>4} x{key[2]:<3} p99 {old_p99:.3f}s -> {new_p99:.3f}s ({change:+.1f}%)"
+        )
+
+
+def _parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--url",
+        required=True,
+        help="Base URL of the Pyroscope HTTP API (i.e. the coordinator's nginx).",
+    )
+    parser.add_argument("--ca-path", default=None)
+    parser.add_argument(
+        "--server-name",
+        default=None,
+        help="Server name to expect in the TLS certificate, if it doesn't match the URL.",
+    )
+    parser.add_argument("--service", default="querybench")
+    parser.add_argument(
+        "--query", dest="queries", choices=QUERIES, action="append", default=None
+    )
+    parser.add_argument(
+        "--range",
+        dest="ranges",
+        type=parse_duration,
+        action="append",
+        default=None,
+        help=f"Query time range; can be repeated. Defaults to {', '.join(DEFAULT_RANGES)}.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=positive_int,
+        action="append",
+        default=None,
+        help=f"Concurrency level; can be repeated. Defaults to {DEFAULT_CONCURRENCY}.",
+    )
+    parser.add_argument(
+        "--requests",
+        type=positive_int,
+        default=50,
+        help="Number of requests for each query, range and concurrency level.",
+    )
+    parser.add_argument("--output", default="querybench.json")
+    parser.add_argument("--baseline", default=None)
+
+    seed = parser.add_argument_group("seeding")
+    seed.add_argument(
+        "--seed-endpoint",
+        default=None,
+        help="OTLP gRPC endpoint to send profiles to before benchmarking.",
+    )
+    seed.add_argument(
+        "--seed-insecure", action=argparse.BooleanOptionalAction, default=True
+    )
+    seed.add_argument(
+        "--seed-duration",
+        type=float,
+        default=30,
+        help="Seconds to send profiles for; the seeded profiles only span this much time.",
+    )
+    seed.add_argument("--seed-rate", type=float, default=10)
+    seed.add_argument(
+        "--seed-settle",
+        type=float,
+        default=10,
+        help="Seconds to wait after seeding, for the profiles to become queryable.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    logging.basicConfig(level=logging.INFO)
+    args = _parse_args(argv)
+    queries = args.queries or list(QUERIES)
+    ranges = args.ranges or [parse_duration(r) for r in DEFAULT_RANGES]
+    concurrency_levels = args.concurrency or list(DEFAULT_CONCURRENCY)
+
+    report: dict = {
+        "url": args.url,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "seed": None,
+        "results": [],
+    }
+
+    if args.seed_endpoint:
+        logger.info("seeding %s for %ss", args.seed_endpoint, args.seed_duration)
+        stats = generate_load(
+            endpoint=args.seed_endpoint,
+            insecure=args.seed_insecure,
+            duration=args.seed_duration,
+            rate=args.seed_rate,
+            services=[args.service],
+            spec=ProfileSpec(
+                stack_depth=16,
+                functions=200,
+                stacks=100,
+                samples=50,
+                labels={"region": 3, "pod": 10},
+            ),
+            ca_path=args.ca_path,
+            server_name=args.server_name,
+        )
+        report["seed"] = stats.as_dict()
+        time.sleep(args.seed_settle)
+        if longer := [r for r in ranges if r > args.seed_duration]:
+            logger.warning(
+                "the seeded profiles only span the last %ss: the %ss ranges are mostly empty",
+                args.seed_duration,
+                ", ".join(map(str, longer)),
+            )
+
+    client = PyroscopeClient(
+        args.url,
+        ca_path=args.ca_path,
+        server_name=args.server_name,
+        pool_size=max(concurrency_levels),
+    )
+    for name in queries:
+        for time_range in ranges:
+            for concurrency in concurrency_levels:
+                logger.info(
+                    "running %s over %ss with concurrency %s",
+                    name,
+                    time_range,
+                    concurrency,
+                )
+                result = run_query(
+                    client,
+                    QUERIES[name],
+                    args.service,
+                    time_range,
+                    concurrency,
+                    args.requests,
+                )
+                report["results"].append(
+                    {
+                        "query": name,
+                        "range": time_range,
+                        "concurrency": concurrency,
+                        **result,
+                    }
+                )
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info("report written to %s", args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+    if any(r["errors"] for r in report["results"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,44 @@
 #!/usr/bin/env python3
 # Copyright 2025 Canonical Ltd.
 # See LICENSE file for licensing details.
-import json
-import subprocess
-import shlex
 from typing import Optional
 import logging
 
+from pyroscope_client import PyroscopeClient, get_client
+
 logger = logging.getLogger(__name__)
 
 
-def assert_profile_is_ingested(
+def _client(
     hostname: str,
-    service_name: str = "profilegen",
     tls: bool = False,
     ca_path: Optional[str] = None,
     server_name: Optional[str] = None,
-):
+) -> PyroscopeClient:
     scheme = f"http{'s' if tls else ''}"
     port = "8080"
-    target_hostname = server_name or hostname
-
-    cmd = (
-        "curl -s --get --data-urlencode "
-        f"'query=process_cpu:cpu:nanoseconds:cpu:nanoseconds{{service_name=\"{service_name}\"}}' "
-        '--data-urlencode "from=now-1h" '
-        f"{scheme}://{target_hostname}:{port}/pyroscope/render"
+    return get_client(
+        f"{scheme}://{hostname}:{port}",
+        ca_path=str(ca_path) if ca_path else None,
+        server_name=server_name,
     )
 
-    if ca_path:
-        cmd += f" --cacert {ca_path}"
-    if server_name:
-        cmd += f" --resolve {target_hostname}:{port}:{hostname}"
 
-    logger.info(f"running: {cmd!r}")
-    out = subprocess.run(shlex.split(cmd), text=True, capture_output=True, check=True)
-
-    flames = json.loads(out.stdout)
+def assert_profile_is_ingested(
+    hostname: str,
+    service_name: str = "profilegen",
+    tls: bool = False,
+    ca_path: Optional[str] = None,
+    server_name: Optional[str] = None,
+):
+    client = _client(hostname, tls, ca_path, server_name)
+    logger.info(f"querying {client.url} for {service_name!r} profiles")
+    flames = client.render(service_name, start="now-1h")
 
     # equivalent to: jq -r '.flamebearer.levels[0] | add'"
     tot_levels = sum(flames["flamebearer"]["levels"][0])
     # if there's no data, this will be a zeroes array.
-    assert tot_levels > 0, f"No data in graph obtained by {cmd}"
+    assert tot_levels > 0, f"No data in graph obtained from {client.url}"
 
 
 def assert_no_profiles(
@@ -51,26 +48,9 @@ def assert_no_profiles(
     ca_path: Optional[str] = None,
     server_name: Optional[str] = None,
 ):
-    scheme = f"http{'s' if tls else ''}"
-    port = "8080"
-    target_hostname = server_name or hostname
-
-    cmd = (
-        "curl -s --get --data-urlencode "
-        f"'query=process_cpu:cpu:nanoseconds:cpu:nanoseconds{{service_name=\"{service_name}\"}}' "
-        '--data-urlencode "from=now-1m" '
-        f"{scheme}://{target_hostname}:{port}/pyroscope/render"
-    )
-
-    if ca_path:
-        cmd += f" --cacert {ca_path}"
-    if server_name:
-        cmd += f" --resolve {target_hostname}:{port}:{hostname}"
-
-    logger.info(f"running: {cmd!r}")
-    out = subprocess.run(shlex.split(cmd), text=True, capture_output=True, check=True)
-
-    flames = json.loads(out.stdout)
+    client = _client(hostname, tls, ca_path, server_name)
+    logger.info(f"querying {client.url} for {service_name!r} profiles")
+    flames = client.render(service_name, start="now-1m")
 
     # profile is removed if numTicks (number of samples) is 0
     num_ticks = flames["flamebearer"]["numTicks"]
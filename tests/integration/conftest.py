@@ -4,6 +4,7 @@ import logging
 from pathlib import Path
 import tempfile
 
+import pytest
 from pytest import fixture
 
 from tests.integration.helpers import charm_and_channel_and_resources, SSC_APP
@@ -13,6 +14,14 @@ from jubilant import Juju
 logger = logging.getLogger(__name__)
 
 
+def pytest_collection_modifyitems(config, items):
+    # The steps of a scenario depend on each other, so a module must never be split across
+    # pytest-xdist workers. Run with `-n <workers> --dist loadgroup` to deploy the modules
+    # in parallel, each in a model of its own.
+    for item in items:
+        item.add_marker(pytest.mark.xdist_group(item.module.__name__))
+
+
 @fixture(scope="session")
 def coordinator_charm():
     """Pyroscope coordinator used for integration testing."""
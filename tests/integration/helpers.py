@@ -3,15 +3,17 @@
 import json
 import logging
 import os
-import shlex
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Literal, Optional, Sequence
+from typing import Dict, Literal, Optional, Sequence
 
 import jubilant
 from jubilant import Juju
 from pytest_jubilant import get_resources, pack
 
+import pyroscope_client
+
 REPO_ROOT = Path(__file__).resolve().parents[2]
 
 CI_TRUE_VALUES = {"1", "true", "yes"}
@@ -40,7 +42,6 @@ ALL_ROLES = [
 ]
 ALL_WORKERS = [f"{WORKER_APP}-" + role for role in ALL_ROLES]
 INTEGRATION_TESTERS_CHANNEL = "2/edge"
-PROFILEGEN_SCRIPT_PATH = REPO_ROOT / "scripts" / "profilegen.py"
 
 logger = logging.getLogger(__name__)
 
@@ -126,28 +127,12 @@ def deploy_distributed_cluster(
     wait_for_idle: bool = True,
 ):
     """Deploy a pyroscope distributed cluster."""
-    worker_charm_url, channel, resources = charm_and_channel_and_resources(
-        "worker", "WORKER_CHARM_PATH", "WORKER_CHARM_CHANNEL"
-    )
-
-    all_workers = []
-
-    for role in roles:
-        worker_name = f"{WORKER_APP}-{role}"
-        all_workers.append(worker_name)
-
-        juju.deploy(
-            worker_charm_url,
-            app=worker_name,
-            channel=channel,
-            trust=True,
-            config={"role-all": False, f"role-{role}": True},
-            resources=resources,
-        )
-
     return _deploy_cluster(
         juju,
-        all_workers,
+        {
+            f"{WORKER_APP}-{role}": {"role-all": False, f"role-{role}": True}
+            for role in roles
+        },
         coordinator_deployed_as=coordinator_deployed_as,
         wait_for_idle=wait_for_idle,
     )
@@ -157,20 +142,9 @@ def deploy_monolithic_cluster(
     juju: Juju, coordinator_deployed_as=None, wait_for_idle: bool = True
 ):
     """Deploy a pyroscope-monolithic cluster."""
-    worker_charm_url, channel, resources = charm_and_channel_and_resources(
-        "worker", "WORKER_CHARM_PATH", "WORKER_CHARM_CHANNEL"
-    )
-
-    juju.deploy(
-        worker_charm_url,
-        app=WORKER_APP,
-        channel=channel,
-        trust=True,
-        resources=resources,
-    )
     return _deploy_cluster(
         juju,
-        [WORKER_APP],
+        {WORKER_APP: None},
         coordinator_deployed_as=coordinator_deployed_as,
         wait_for_idle=wait_for_idle,
     )
@@ -178,26 +152,53 @@ def deploy_monolithic_cluster(
 
 def _deploy_cluster(
     juju: Juju,
-    workers: Sequence[str],
+    workers: Dict[str, Optional[Dict[str, bool]]],
     coordinator_deployed_as: str = None,
     wait_for_idle: bool = False,
 ):
-    logger.info("deploying cluster")
+    """Deploy the coordinator, the workers (with their config) and the s3 backend, and relate them.
 
-    if coordinator_deployed_as:
-        coordinator_app = coordinator_deployed_as
-    else:
+    All applications are deployed concurrently: each `juju deploy` spends most of its time
+    waiting on the controller, so there's no point in deploying one at a time.
+    """
+    logger.info("deploying cluster")
+    worker_charm_url, worker_channel, worker_resources = (
+        charm_and_channel_and_resources(
+            "worker", "WORKER_CHARM_PATH", "WORKER_CHARM_CHANNEL"
+        )
+    )
+    coordinator_app = coordinator_deployed_as or PYROSCOPE_APP
+
+    deployments = {
+        worker: {
+            "charm": worker_charm_url,
+            "channel": worker_channel,
+            "trust": True,
+            "config": config,
+            "resources": worker_resources,
+        }
+        for worker, config in workers.items()
+    }
+    deployments[SWFS_APP] = {"charm": "seaweedfs-k8s", "channel": "latest/edge"}
+    if not coordinator_deployed_as:
         coordinator_charm_url, channel, resources = charm_and_channel_and_resources(
             "coordinator", "COORDINATOR_CHARM_PATH", "COORDINATOR_CHARM_CHANNEL"
         )
-        juju.deploy(
-            coordinator_charm_url,
-            PYROSCOPE_APP,
-            channel=channel,
-            resources=resources,
-            trust=True,
-        )
-        coordinator_app = PYROSCOPE_APP
+        deployments[PYROSCOPE_APP] = {
+            "charm": coordinator_charm_url,
+            "channel": channel,
+            "resources": resources,
+            "trust": True,
+        }
+
+    with ThreadPoolExecutor() as executor:
+        futures = [
+            executor.submit(juju.deploy, app=app, **kwargs)
+            for app, kwargs in deployments.items()
+        ]
+        # this also re-raises any deployment error
+        for future in futures:
+            future.result()
 
     for worker in workers:
         juju.integrate(
@@ -235,24 +236,13 @@ def emit_profile(
     ca_path: Optional[str] = None,
     server_name: Optional[str] = None,
 ):
-    env = os.environ.copy()
-
-    profilegen_env = {
-        "PROFILEGEN_SERVICE": service_name,
-        "PROFILEGEN_ENDPOINT": endpoint,
-        "PROFILEGEN_INSECURE": str(not tls),
-    }
-    if ca_path:
-        profilegen_env["PROFILEGEN_CA_PATH"] = ca_path
-    if server_name:
-        profilegen_env["PROFILEGEN_SERVER_NAME"] = server_name
-
-    env.update(profilegen_env)
-
-    cmd = f"python {str(PROFILEGEN_SCRIPT_PATH)}"
-
-    logger.info(f"running profilegen with env: {profilegen_env!r}")
-    out = subprocess.run(
-        shlex.split(cmd), text=True, capture_output=True, check=True, env=env
+    logger.info(f"sending a profile for {service_name!r} to {endpoint}")
+    # in-process, over a cached gRPC channel: no interpreter startup or TLS handshake per call
+    pyroscope_client.emit_profile(
+        endpoint=endpoint,
+        service_name=service_name,
+        insecure=not tls,
+        ca_path=str(ca_path) if ca_path else None,
+        server_name=server_name,
+        timeout=30,
     )
-    logger.info(f"profilegen completed; stdout={out.stdout!r}")
@@ -6,9 +6,10 @@
 
 import logging
 
+from ops import BlockedStatus, CollectStatusEvent
 from ops.charm import CharmBase
 
-from pyroscope import PyroscopeWorker
+from pyroscope import PyroscopeWorker, is_valid_gomemlimit
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +20,17 @@ class PyroscopeWorkerCharm(CharmBase):
     def __init__(self, *args):
         super().__init__(*args)
         self.worker = PyroscopeWorker(self)
+        self.framework.observe(
+            self.on.collect_unit_status, self._on_collect_unit_status
+        )
+
+    def _on_collect_unit_status(self, event: CollectStatusEvent):
+        if not is_valid_gomemlimit(self.config.get("gomemlimit")):
+            event.add_status(
+                BlockedStatus(
+                    'Invalid gomemlimit: expected a number of bytes, e.g. "900MiB".'
+                )
+            )
 
 
 if __name__ == "__main__":  # pragma: nocover
@@ -5,33 +5,104 @@
 """Pyroscope workload management objects."""
 
 import logging
+import math
+import re
 import socket
+from typing import Any, Dict, Optional
 
+import yaml
+from lightkube.utils.quantity import parse_quantity
 from ops.charm import CharmBase
 from coordinated_workers.worker import Worker, CONFIG_FILE
 from ops.pebble import Layer
 
 API_PORT = 4040
+# resources requests of each role, as (cpu millicores, memory MiB).
+# ingesters (head blocks), store-gateways (block indexes) and compactors hold profiles in memory;
+# queriers and distributors (decompression, validation) are mostly cpu-bound.
+# "all" is meant for small deployments, so it keeps requests low.
+# cfr. https://github.com/grafana/pyroscope/blob/v1.14.0/operations/pyroscope/helm/pyroscope/values-micro-services.yaml
+ROLES_RESOURCES_REQUESTS = {
+    "all": (100, 256),
+    "querier": (500, 256),
+    "query-frontend": (100, 128),
+    "query-scheduler": (100, 128),
+    "ingester": (250, 1024),
+    "distributor": (250, 256),
+    "compactor": (250, 512),
+    "store-gateway": (100, 512),
+    "tenant-settings": (50, 64),
+    "ad-hoc-profiles": (50, 64),
+}
+# share of the memory limit the go runtime aims to stay under, leaving some headroom for
+# the memory the runtime doesn't account for (e.g. cgo, the stacks of the os threads)
+GOMEMLIMIT_RATIO = 0.9
+# what the go runtime accepts as GOMEMLIMIT: a number of bytes, with an optional unit suffix
+GOMEMLIMIT_REGEXP = re.compile(r"^[0-9]+(B|KiB|MiB|GiB|TiB)?$")
+# key of the worker config holding the settings of the worker charm, which aren't part of
+# the pyroscope config: pyroscope refuses unknown keys, so it's removed before writing the config
+CHARM_CONFIG_KEY = "charm"
+# where the worker config tells pyroscope to load the runtime config from
+RUNTIME_CONFIG_FILE = "/etc/worker/runtime-config.yaml"
+CLUSTER_ENDPOINT = "pyroscope-cluster"
 
 
 logger = logging.getLogger(__name__)
 
 
+def _charm_config(worker_config: Any) -> Dict[str, Any]:
+    """Return the settings of the worker charm the coordinator distributes in the worker config."""
+    if not isinstance(worker_config, dict):
+        return {}
+    return worker_config.get(CHARM_CONFIG_KEY) or {}
+
+
+class _PyroscopeWorker(Worker):
+    """Worker that writes the worker charm settings to disk, and the rest as pyroscope config."""
+
+    @property
+    def _worker_config(self):
+        # the Worker lets charms adapt the config here, before writing it to disk and (re)starting
+        # pyroscope: the runtime config the worker config points to is written beforehand
+        worker_config = self.cluster.get_worker_config()
+        self._update_runtime_config(_charm_config(worker_config).get("runtime_config"))
+        if isinstance(worker_config, dict):
+            worker_config.pop(CHARM_CONFIG_KEY, None)
+        return worker_config
+
+    def _update_runtime_config(self, runtime_config: Optional[Dict[str, Any]]):
+        """Write the runtime config (the per-tenant overrides) distributed by the coordinator.
+
+        Pyroscope periodically reloads the runtime config, so changing it doesn't take a restart.
+        If the coordinator distributes none, the worker config doesn't point to it: it's removed.
+        """
+        container = self.model.unit.get_container(PyroscopeWorker._name)
+        if not container.can_connect():
+            return
+        if runtime_config is None:
+            container.remove_path(RUNTIME_CONFIG_FILE, recursive=True)
+            return
+        runtime_config_yaml = yaml.safe_dump(runtime_config)
+        if (
+            not container.exists(RUNTIME_CONFIG_FILE)
+            or container.pull(RUNTIME_CONFIG_FILE).read() != runtime_config_yaml
+        ):
+            container.push(RUNTIME_CONFIG_FILE, runtime_config_yaml, make_dirs=True)
+            logger.info("Pushed new runtime configuration")
+
+
 class PyroscopeWorker:
     _name = "pyroscope"
 
     def __init__(self, charm: CharmBase):
-        self._worker = Worker(
+        self._worker = _PyroscopeWorker(
             charm=charm,
             name=self._name,
             pebble_layer=self.layer,
-            endpoints={"cluster": "pyroscope-cluster"},
+            endpoints={"cluster": CLUSTER_ENDPOINT},
             readiness_check_endpoint=self.readiness_check_endpoint,
             container_name=self._name,
-            # each worker needs different resources.
-            # we set minimal requests just to ensure scheduling — won’t affect actual performance since limits handle that.
-            # cfr. https://github.com/grafana/pyroscope/blob/v1.14.0/operations/pyroscope/helm/pyroscope/values-micro-services.yaml
-            resources_requests=lambda _: {"cpu": "100m", "memory": "256Mi"},
+            resources_requests=self.resources_requests,
         )
 
     @staticmethod
@@ -52,16 +123,20 @@ class PyroscopeWorker:
                     "JAEGER_ENDPOINT": (
                         f"{tempo_endpoint}/api/traces?format=jaeger.thrift"
                     ),
-                    "JAEGER_SAMPLER_PARAM": "1",
-                    "JAEGER_SAMPLER_TYPE": "const",
+                    **PyroscopeWorker._sampler_env(worker),
                     "JAEGER_TAGS": f"juju_application={topology.application},juju_model={topology.model}"
                     + f",juju_model_uuid={topology.model_uuid},juju_unit={topology.unit},juju_charm={topology.charm_name}",
                 }
             )
 
+        env.update(PyroscopeWorker._go_runtime_env(worker))
+
         roles = worker.roles
         # sort the roles to avoid unnecessary replans
         roles = sorted(roles)
+        command = (
+            f"/usr/bin/pyroscope -config.file={CONFIG_FILE} -target={','.join(roles)}"
+        )
         return Layer(
             {
                 "summary": "pyroscope worker layer",
@@ -71,7 +146,7 @@ class PyroscopeWorker:
                         "override": "replace",
                         "summary": "pyroscope worker process",
                         # Allow configuring multiple roles for one worker application
-                        "command": f"/usr/bin/pyroscope -config.file={CONFIG_FILE} -target={','.join(roles)}",
+                        "command": command,
                         "startup": "enabled",
                         "environment": env,
                     }
@@ -79,9 +154,78 @@ class PyroscopeWorker:
             }
         )
 
+    @staticmethod
+    def resources_requests(worker: Worker) -> Dict[str, str]:
+        """Return the resources requests of the workload container, given the roles of the worker.
+
+        The requests of each role add up, and are capped by the configured limits.
+        """
+        roles = worker.roles or ["all"]
+        cpu = sum(ROLES_RESOURCES_REQUESTS[role][0] for role in roles)
+        memory = sum(ROLES_RESOURCES_REQUESTS[role][1] for role in roles)
+        # kubernetes refuses requests greater than the limits
+        if cpu_limit := _parse_limit(worker.model.config.get("cpu_limit")):
+            cpu = min(cpu, int(cpu_limit * 1000))
+        if memory_limit := _parse_limit(worker.model.config.get("memory_limit")):
+            memory = min(memory, int(memory_limit / 2**20))
+        return {"cpu": f"{cpu}m", "memory": f"{memory}Mi"}
+
+    @staticmethod
+    def _go_runtime_env(worker: Worker) -> Dict[str, str]:
+        """Return the environment variables fitting the go runtime to the container limits.
+
+        Without them, the go runtime schedules goroutines on all the cores of the node (and gets
+        throttled by the cpu limit), and only collects garbage when the heap doubles (and gets
+        OOM-killed by the memory limit). The gomaxprocs and gomemlimit options take precedence.
+        """
+        config = worker.model.config
+        env = {}
+        if gomaxprocs := config.get("gomaxprocs"):
+            env["GOMAXPROCS"] = str(gomaxprocs)
+        elif cpu_limit := _parse_limit(config.get("cpu_limit")):
+            env["GOMAXPROCS"] = str(max(1, math.ceil(cpu_limit)))
+        if gomemlimit := config.get("gomemlimit"):
+            # the charm is blocked: don't set a limit pyroscope would fail to start with
+            if is_valid_gomemlimit(gomemlimit):
+                env["GOMEMLIMIT"] = str(gomemlimit)
+        elif memory_limit := _parse_limit(config.get("memory_limit")):
+            env["GOMEMLIMIT"] = str(int(memory_limit * GOMEMLIMIT_RATIO))
+        return env
+
+    @staticmethod
+    def _sampler_env(worker: Worker) -> Dict[str, str]:
+        """Return the environment variables configuring the Jaeger sampler of the workload traces."""
+        # trace all requests, unless the coordinator tells us otherwise
+        sampler = _charm_config(worker.cluster.get_worker_config()).get(
+            "workload_tracing_sampler", {"type": "const", "param": 1}
+        )
+        env = {
+            "JAEGER_SAMPLER_TYPE": str(sampler["type"]),
+            "JAEGER_SAMPLER_PARAM": str(sampler["param"]),
+        }
+        if server_url := sampler.get("server_url"):
+            env["JAEGER_SAMPLING_ENDPOINT"] = server_url
+        return env
+
     @staticmethod
     def readiness_check_endpoint(worker: Worker) -> str:
         """Endpoint for worker readiness checks."""
         # e2e TLS in upstream is not supported yet
         # https://github.com/grafana/pyroscope/issues/3598
         return f"http://{socket.getfqdn()}:{API_PORT}/ready"
+
+
+def is_valid_gomemlimit(gomemlimit: Optional[str]) -> bool:
+    """Whether the gomemlimit option is unset, or set to a limit the go runtime accepts."""
+    return not gomemlimit or bool(GOMEMLIMIT_REGEXP.match(gomemlimit))
+
+
+def _parse_limit(limit: Optional[str]) -> Optional[float]:
+    """Parse a kubernetes resource limit; None if it's unset or invalid."""
+    if not limit:
+        return None
+    try:
+        return float(parse_quantity(limit))
+    except ValueError:
+        logger.warning("invalid resource limit: %s", limit)
+        return None
@@ -1,5 +1,6 @@
 import json
 import ops
+import pytest
 from ops.testing import State, Relation
 from tests.unit.conftest import config_on_disk, endpoint_ready, k8s_patch
 
@@ -46,3 +47,27 @@ def test_patch_k8s_waiting(ctx, pyroscope_container):
     )
 
     assert state_out.unit_status == ops.WaitingStatus("")
+
+
+@config_on_disk()
+@endpoint_ready()
+@pytest.mark.parametrize("gomemlimit", ("512M", "1.5GiB", "512 MiB", "-1"))
+def test_invalid_gomemlimit(ctx, pyroscope_container, gomemlimit):
+    state_out = ctx.run(
+        ctx.on.config_changed(),
+        state=State(
+            containers=[pyroscope_container],
+            relations=[
+                Relation(
+                    "pyroscope-cluster",
+                    remote_app_data={
+                        "worker_config": json.dumps("beef"),
+                    },
+                )
+            ],
+            config={"role-all": True, "gomemlimit": gomemlimit},
+        ),
+    )
+
+    assert state_out.unit_status.name == "blocked"
+    assert "gomemlimit" in state_out.unit_status.message
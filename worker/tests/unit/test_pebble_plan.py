@@ -5,6 +5,7 @@ import os
 import socket
 from unittest.mock import MagicMock, patch
 import pytest
+import yaml
 from ops.model import ActiveStatus
 from scenario import Relation, State
 from cosl import JujuTopology
@@ -60,10 +61,8 @@ def test_pebble_ready_plan(ctx, pyroscope_container, roles, https_proxy):
     plan_out = pyroscope_container_out.plan.to_dict()
 
     assert plan_out["checks"]["ready"]["http"]["url"] == f"http://{host}:4040/ready"
-    assert (
-        plan_out["services"]["pyroscope"]["command"]
-        == f"/usr/bin/pyroscope -config.file=/etc/worker/config.yaml -target={','.join(roles)}"
-    )
+    expected_command = f"/usr/bin/pyroscope -config.file=/etc/worker/config.yaml -target={','.join(roles)}"
+    assert plan_out["services"]["pyroscope"]["command"] == expected_command
     assert plan_out["services"]["pyroscope"]["environment"]["https_proxy"] == "0.0.0.1"
     # AND the pebble service is running
     assert pyroscope_container_out.services.get("pyroscope").is_running() is True
@@ -133,3 +132,96 @@ def test_tracing_config_in_pebble_plan(ctx, pyroscope_container):
         plan_out["services"]["pyroscope"]["environment"]["JAEGER_TAGS"]
         == "juju_application=worker,juju_model=test,juju_model_uuid=00000000-0000-4000-8000-000000000000,juju_unit=worker/0,juju_charm=pyroscope"
     )
+
+
+@config_on_disk()
+@endpoint_ready()
+def test_tracing_sampler_in_pebble_plan(ctx, pyroscope_container):
+    # GIVEN a workload tracing endpoint and a remote sampler in the worker config
+    state = State(
+        containers=[pyroscope_container],
+        relations=[
+            Relation(
+                "pyroscope-cluster",
+                remote_app_data={
+                    "worker_config": json.dumps(
+                        yaml.safe_dump(
+                            {
+                                "server": {"http_listen_port": 4040},
+                                "charm": {
+                                    "workload_tracing_sampler": {
+                                        "type": "remote",
+                                        "param": 0.1,
+                                        "server_url": "http://jaeger:5778/sampling",
+                                    }
+                                },
+                            }
+                        )
+                    ),
+                    "workload_tracing_receivers": json.dumps(
+                        {"jaeger_thrift_http": "http://127.0.0.1"}
+                    ),
+                },
+            ),
+        ],
+        config={
+            "role-all": True,
+        },
+    )
+    # WHEN a workload pebble ready event is fired
+    state_out = ctx.run(ctx.on.pebble_ready(pyroscope_container), state=state)
+
+    # THEN the pebble plan configures the jaeger sampler as the coordinator says
+    environment = state_out.get_container(pyroscope_container.name).plan.to_dict()[
+        "services"
+    ]["pyroscope"]["environment"]
+    assert environment["JAEGER_SAMPLER_TYPE"] == "remote"
+    assert environment["JAEGER_SAMPLER_PARAM"] == "0.1"
+    assert environment["JAEGER_SAMPLING_ENDPOINT"] == "http://jaeger:5778/sampling"
+
+
+@config_on_disk()
+@endpoint_ready()
+@pytest.mark.parametrize(
+    "config, expected_env",
+    (
+        ({}, {}),
+        (
+            {"cpu_limit": "1500m", "memory_limit": "1Gi"},
+            {"GOMAXPROCS": "2", "GOMEMLIMIT": str(int(2**30 * 0.9))},
+        ),
+        (
+            {
+                "cpu_limit": "1500m",
+                "memory_limit": "1Gi",
+                "gomaxprocs": 4,
+                "gomemlimit": "512MiB",
+            },
+            {"GOMAXPROCS": "4", "GOMEMLIMIT": "512MiB"},
+        ),
+        # an invalid gomemlimit is left unset, rather than replaced by the derived one
+        ({"memory_limit": "1Gi", "gomemlimit": "512M"}, {}),
+    ),
+)
+def test_go_runtime_env_in_pebble_plan(ctx, pyroscope_container, config, expected_env):
+    # GIVEN a worker with some resources limits and go runtime options
+    state = State(
+        containers=[pyroscope_container],
+        relations=[
+            Relation(
+                "pyroscope-cluster",
+                remote_app_data={"worker_config": json.dumps("beef")},
+            ),
+        ],
+        config={"role-all": True, **config},
+    )
+    # WHEN a workload pebble ready event is fired
+    state_out = ctx.run(ctx.on.pebble_ready(pyroscope_container), state=state)
+
+    # THEN the go runtime is fitted to the container limits, unless overridden
+    environment = state_out.get_container(pyroscope_container.name).plan.to_dict()[
+        "services"
+    ]["pyroscope"]["environment"]
+    assert {
+        key: value for key, value in environment.items() if key.startswith("GO")
+    } == expected_env
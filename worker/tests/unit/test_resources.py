@@ -0,0 +1,45 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+import dataclasses
+
+import pytest
+from scenario import State
+
+from helpers import set_roles
+from pyroscope import PyroscopeWorker
+
+
+@pytest.mark.parametrize(
+    "roles, limits, expected",
+    (
+        (["all"], {}, {"cpu": "100m", "memory": "256Mi"}),
+        (["ingester"], {}, {"cpu": "250m", "memory": "1024Mi"}),
+        (["querier"], {}, {"cpu": "500m", "memory": "256Mi"}),
+        (
+            ["compactor", "store-gateway"],
+            {},
+            {"cpu": "350m", "memory": "1024Mi"},
+        ),
+        (
+            ["ingester"],
+            {"cpu_limit": "200m", "memory_limit": "0.5Gi"},
+            {"cpu": "200m", "memory": "512Mi"},
+        ),
+        (
+            ["querier"],
+            {"cpu_limit": "2", "memory_limit": "4Gi"},
+            {"cpu": "500m", "memory": "256Mi"},
+        ),
+    ),
+)
+def test_resources_requests(ctx, pyroscope_container, roles, limits, expected):
+    # GIVEN a worker with some roles and resources limits
+    state = set_roles(State(containers=[pyroscope_container]), roles)
+    state = dataclasses.replace(state, config={**state.config, **limits})
+
+    # WHEN the resources requests are computed
+    with ctx(ctx.on.update_status(), state) as mgr:
+        requests = PyroscopeWorker.resources_requests(mgr.charm.worker._worker)
+
+    # THEN they depend on the roles, and never exceed the limits
+    assert requests == expected
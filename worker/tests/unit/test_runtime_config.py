@@ -0,0 +1,91 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+import json
+from dataclasses import replace
+
+import pytest
+import yaml
+from scenario import Mount, Relation, State
+
+from conftest import config_on_disk, endpoint_ready
+
+
+@config_on_disk()
+@endpoint_ready()
+@pytest.mark.parametrize(
+    "worker_config, expected",
+    (
+        # no runtime config unless the coordinator distributes one
+        ({"runtime_config": {"file": "/etc/worker/runtime-config.yaml"}}, None),
+        (
+            {
+                "runtime_config": {"file": "/etc/worker/runtime-config.yaml"},
+                "charm": {
+                    "runtime_config": {
+                        "overrides": {"ci": {"compactor_blocks_retention_period": "1d"}}
+                    }
+                },
+            },
+            "overrides:\n  ci:\n    compactor_blocks_retention_period: 1d\n",
+        ),
+    ),
+)
+def test_runtime_config_on_disk(ctx, pyroscope_container, worker_config, expected):
+    # GIVEN a pyroscope-cluster relation, with or without a runtime config in the worker config
+    state = State(
+        containers=[pyroscope_container],
+        relations=[
+            Relation(
+                "pyroscope-cluster",
+                remote_app_data={
+                    "worker_config": json.dumps(yaml.safe_dump(worker_config))
+                },
+            ),
+        ],
+        config={"role-all": True},
+    )
+    # WHEN any event is fired
+    state_out = ctx.run(ctx.on.update_status(), state=state)
+
+    # THEN the runtime config pyroscope loads the per-tenant overrides from is written
+    filesystem = state_out.get_container(pyroscope_container.name).get_filesystem(ctx)
+    runtime_config = filesystem / "etc" / "worker" / "runtime-config.yaml"
+    if expected is None:
+        assert not runtime_config.exists()
+    else:
+        assert runtime_config.read_text() == expected
+    # AND the worker charm settings aren't part of the pyroscope config
+    pyroscope_config = yaml.safe_load(
+        (filesystem / "etc" / "worker" / "config.yaml").read_text()
+    )
+    assert pyroscope_config == {
+        "runtime_config": {"file": "/etc/worker/runtime-config.yaml"}
+    }
+
+
+@config_on_disk()
+@endpoint_ready()
+def test_runtime_config_removed(ctx, pyroscope_container, tmp_path):
+    # GIVEN a worker holding the overrides of a runtime config the coordinator no longer publishes
+    runtime_config = tmp_path / "runtime-config.yaml"
+    runtime_config.write_text("overrides: {}\n")
+    state = State(
+        containers=[
+            replace(
+                pyroscope_container,
+                mounts={"config": Mount(location="/etc/worker", source=tmp_path)},
+            )
+        ],
+        relations=[
+            Relation(
+                "pyroscope-cluster",
+                remote_app_data={"worker_config": json.dumps("beef")},
+            ),
+        ],
+        config={"role-all": True},
+    )
+    # WHEN any event is fired
+    ctx.run(ctx.on.update_status(), state=state)
+
+    # THEN the runtime config is removed, as the worker config no longer points to it
+    assert not runtime_config.exists()